@@ -14,8 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
 import sys
+import time
+
+import retrieval
+import workload
 
 try:
   import google.generativeai as genai
@@ -55,6 +60,7 @@ class AI:
 
   @classmethod
   def Options(cls):
+    yield RecordedAI
     yield GoogleGenAI
     yield OpenAI
     yield MistralAI
@@ -133,6 +139,48 @@ class MistralAI(AI):
     return result
 
 
+class RecordedAI(AI):
+  """Deterministic stand-in for LLM, for load tests without network.
+
+  Key is path of a workload recorded by the server. Requests are answered
+  with their recorded translations after a latency given in seconds by
+  LOGICLM_RECORDED_AI_LATENCY_SECONDS. Unknown requests get a request of
+  the default measure and dimension.
+  """
+  api_key_system_variable = 'LOGICLM_RECORDED_AI'
+  request_marker = 'Write me JSON for this request: '
+
+  def SetAPIKey(self, api_key):
+    self.api_key = api_key
+    self.translations = workload.RecordedTranslations(api_key)
+    self.latency_seconds = float(
+      os.getenv('LOGICLM_RECORDED_AI_LATENCY_SECONDS', '0'))
+
+  def __init__(self, api_key=None):
+    super().__init__()
+    if api_key:
+      self.SetAPIKey(api_key)
+
+  @classmethod
+  def FromTranslations(cls, translations, latency_seconds=0):
+    """AI answering with the given translations of the requests."""
+    result = cls()
+    result.translations = translations
+    result.latency_seconds = latency_seconds
+    return result
+
+  def __call__(self, prompt):
+    user_request = prompt[prompt.rfind(self.request_marker) +
+                          len(self.request_marker):]
+    time.sleep(self.latency_seconds)
+    translation = self.translations.get(user_request, {
+      'title': user_request, 'measures': [], 'dimensions': [],
+      'filters': [], 'order': [], 'limit': -1, 'chartType': 'Table()'})
+    translation = {k: v for k, v in translation.items()
+                   if k not in ['exampleQuery', 'intelligence_config']}
+    return json.dumps(translation)
+
+
 def GetPromptTemplate(config):
   def MaybeDescription(call_object):
     if 'description' in call_object:
@@ -176,6 +224,34 @@ def GetPromptTemplate(config):
   return '\n'.join(result_lines)
 
 
+def ApproximateTokens(text):
+  """Rough number of LLM tokens in the text."""
+  return len(text) // 4
+
+
+def GetCompactPromptTemplate(config, user_request, index=None,
+                             top_k=5, min_confidence=0.75):
+  """Prompt template listing only predicates relevant to the request.
+
+  Returns the template and statistics of its size compared to the full one.
+  """
+  index = index or retrieval.PromptIndex(config)
+  selection = index.Select(user_request, top_k, min_confidence)
+  full_template = GetPromptTemplate(config)
+  template = (full_template if selection.fallback else
+              GetPromptTemplate(selection.SelectedConfig(config)))
+  statistics = {
+    'full_tokens': ApproximateTokens(full_template),
+    'compact_tokens': ApproximateTokens(template),
+    'selected_predicates': sum(
+      len(selection.entries[kind]) for kind, _ in retrieval.CATALOG_KINDS),
+    'catalog_predicates': len(index.catalog),
+    'confidence': round(selection.confidence, 2),
+    'fallback': selection.fallback
+  }
+  return template, statistics
+
+
 if __name__ == '__main__':
   ai = AI.Get()
   print(ai(sys.argv[1]))
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Static assets of the server, rendered and compressed once.
+
+Assets are built when a version of the config is first served. Each is kept
+along with its gzip and, if brotli package is installed, brotli encodings,
+and is validated by ETag and Last-Modified headers.
+"""
+
+import email.utils
+import gzip
+import hashlib
+import time
+
+
+def Brotli():
+  try:
+    import brotli
+  except ImportError:
+    return None
+  return brotli
+
+
+def AcceptedEncodings(accept_encoding):
+  """Encodings the client accepts, from Accept-Encoding header."""
+  result = set()
+  for part in (accept_encoding or '').split(','):
+    name, *parameters = [p.strip() for p in part.split(';')]
+    if name and not any(Quality(p) == 0 for p in parameters):
+      result.add(name.lower())
+  return result
+
+
+def Quality(parameter):
+  name, _, value = parameter.partition('=')
+  if name.strip() != 'q':
+    return None
+  try:
+    return float(value)
+  except ValueError:
+    return None
+
+
+class Asset:
+  """Content of a response, with its encodings and validators."""
+  def __init__(self, content, content_type, built_at=None):
+    self.content = content
+    self.content_type = content_type
+    self.etag = '"%s"' % hashlib.sha256(content).hexdigest()[:32]
+    self.built_at = int(built_at or time.time())
+    self.last_modified = email.utils.formatdate(self.built_at, usegmt=True)
+    self.encodings = {}
+    brotli = Brotli()
+    compressed = {'gzip': gzip.compress(content, 9, mtime=0)}
+    if brotli:
+      compressed['br'] = brotli.compress(content)
+    for encoding, body in compressed.items():
+      # Already compressed content, e.g. PNG, is sent as is.
+      if len(body) < len(content):
+        self.encodings[encoding] = body
+
+  def Body(self, accept_encoding):
+    """Encoding to send, or None for identity, and the body."""
+    accepted = AcceptedEncodings(accept_encoding)
+    for encoding in ['br', 'gzip']:
+      if encoding in self.encodings and encoding in accepted:
+        return encoding, self.encodings[encoding]
+    return None, self.content
+
+  def NotModified(self, if_none_match, if_modified_since):
+    """Whether client's copy is current, per conditional request headers."""
+    if if_none_match:
+      etags = [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+      return '*' in etags or self.etag in etags
+    if if_modified_since:
+      try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+      except (TypeError, ValueError):
+        return False
+      return since.timestamp() >= self.built_at
+    return False
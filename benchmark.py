@@ -0,0 +1,246 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of latency and accuracy of answering questions.
+
+Questions are read from a file with a JSON object per line with fields
+  question: Natural language question.
+  gold_sql: SQL of the expected answer, run on the database of the config.
+  response: Recorded LLM translation of the question.
+Each question is understood, compiled and run as the server does it, with
+recorded translations in place of the LLM, so the benchmark runs offline and
+gives the same answers every time. Config fields can be overridden to see
+how settings trade accuracy for speed, e.g.
+
+  python3 benchmark.py examples/spider/club_1/club_1.json \\
+    examples/spider/club_1/club_1_benchmark.jsonl --set offline_matcher=true
+
+Answer is correct when each column of the gold result is a column of the
+answer, extra columns are allowed. Order of rows matters only if gold SQL
+has ORDER BY.
+
+Database is the one the program attaches, relative to the working directory
+as Logica resolves it, or the one given by --database. Spider databases are
+not in the repo, download the dataset from https://yale-lily.github.io/spider
+and copy database/club_1/club_1.sqlite of it to examples/spider/club_1/, or
+pass it with --database.
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import ai
+import logiclm
+import profiling
+import replay
+import server
+
+
+STAGES = ['understand', 'compile', 'execution']
+
+ATTACH_DATABASE = re.compile(r'@AttachDatabase\("\w+",\s*"([^"]+)"\)')
+
+
+def ReadQuestions(path):
+  with open(path) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+
+class CountingAI:
+  """Counts calls of the AI and approximate tokens of them."""
+  def __init__(self, nous):
+    self.nous = nous
+    self.calls = 0
+    self.prompt_tokens = 0
+    self.response_tokens = 0
+
+  def __call__(self, prompt):
+    response = self.nous(prompt)
+    self.calls += 1
+    self.prompt_tokens += ai.ApproximateTokens(prompt)
+    self.response_tokens += ai.ApproximateTokens(response)
+    return response
+
+
+def Database(config):
+  """Database the program of the config attaches."""
+  with open(config['logica_program']) as f:
+    match = ATTACH_DATABASE.search(f.read())
+  assert match, 'Program does not attach a database, use --database.'
+  return match.group(1)
+
+
+def WithDatabase(config, database, directory):
+  """Config which program attaches the database, written to the directory."""
+  with open(config['logica_program']) as f:
+    program = f.read()
+  assert ATTACH_DATABASE.search(program), (
+    'Program does not attach a database.')
+  program = ATTACH_DATABASE.sub(
+    lambda m: m.group(0).replace(m.group(1), database), program)
+  path = os.path.join(directory, os.path.basename(config['logica_program']))
+  with open(path, 'w') as f:
+    f.write(program)
+  return dict(config, logica_program=path)
+
+
+def GoldRows(database, sql):
+  connection = sqlite3.connect(database)
+  try:
+    return connection.execute(sql).fetchall()
+  finally:
+    connection.close()
+
+
+def Normalized(value):
+  if isinstance(value, float):
+    return round(value, 6)
+  return value
+
+
+def Columns(rows):
+  return [[Normalized(v) for v in column] for column in zip(*rows)]
+
+
+def Matches(rows, gold_rows, ordered):
+  """Whether each column of the gold rows is a column of the rows."""
+  if len(rows) != len(gold_rows):
+    return False
+  if not gold_rows:
+    return True
+  def Key(column):
+    return column if ordered else sorted(column, key=repr)
+  columns = [Key(c) for c in Columns(rows)]
+  for gold_column in Columns(gold_rows):
+    gold_column = Key(gold_column)
+    if gold_column not in columns:
+      return False
+    columns.remove(gold_column)
+  return True
+
+
+def Answer(heart, counting_ai, question):
+  """Answers the question, returning result of the benchmark of it."""
+  calls = counting_ai.calls
+  prompt_tokens = counting_ai.prompt_tokens
+  timer = profiling.StageTimer()
+  with timer.Stage('understand'):
+    json_request = heart.NaturalLanguageToRequestJson(question)
+  json_request.pop('intelligence_config', None)
+  try:
+    _, _, data = heart.RunJson(json_request, profile=timer)
+    error = json_request.get('nice_error')
+  except Exception as e:
+    data, error = [], str(e)
+  return {
+    'stage_seconds': {s: timer.stage_seconds.get(s, 0) for s in STAGES},
+    'llm_calls': counting_ai.calls - calls,
+    'prompt_tokens': counting_ai.prompt_tokens - prompt_tokens,
+    'rows': data[1:],
+    'error': error
+  }
+
+
+def Run(config, questions, database, repeat=1):
+  """Answers the questions repeat times, returning results of each pass."""
+  translations = {q['question']: q['response'] for q in questions}
+  counting_ai = CountingAI(ai.RecordedAI.FromTranslations(translations))
+  heart = server.LogicLMServerHeart(config, counting_ai)
+  gold = [GoldRows(database, q['gold_sql']) for q in questions]
+  passes = []
+  for _ in range(repeat):
+    results = []
+    for q, gold_rows in zip(questions, gold):
+      result = Answer(heart, counting_ai, q['question'])
+      ordered = 'order by' in q['gold_sql'].lower()
+      result['correct'] = (not result['error'] and
+                           Matches(result['rows'], gold_rows, ordered))
+      result['question'] = q['question']
+      results.append(result)
+    passes.append(results)
+  return passes
+
+
+def Report(passes):
+  for i, results in enumerate(passes):
+    print('Pass %d' % (i + 1))
+    print('%-7s %10s %10s %10s %6s  %s' % (
+      'answer', 'understand', 'compile', 'execution', 'tokens', 'question'))
+    for r in results:
+      print('%-7s %9.1fms %9.1fms %9.1fms %6d  %s' % (
+        'ok' if r['correct'] else 'WRONG',
+        *[r['stage_seconds'][s] * 1000 for s in STAGES],
+        r['prompt_tokens'], r['question']))
+      if r['error']:
+        print('        Error: %s' % r['error'][:200].replace('\n', ' '))
+    correct = sum(r['correct'] for r in results)
+    print('Accuracy: %d of %d, %.1f%%.' % (
+      correct, len(results), 100 * correct / len(results)))
+    print('LLM calls: %d, prompt tokens: %d.' % (
+      sum(r['llm_calls'] for r in results),
+      sum(r['prompt_tokens'] for r in results)))
+    for s in STAGES + ['total']:
+      seconds = sorted(
+        sum(r['stage_seconds'].values()) if s == 'total' else
+        r['stage_seconds'][s] for r in results)
+      print('%-10s mean %8.1fms  p50 %8.1fms  p90 %8.1fms' % (
+        s, statistics.mean(seconds) * 1000,
+        replay.Percentile(seconds, 50) * 1000,
+        replay.Percentile(seconds, 90) * 1000))
+    print()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('config', help='Config to answer the questions with.')
+  parser.add_argument('questions', help='Questions with the gold SQL.')
+  parser.add_argument('--database',
+                      help='SQLite database to answer the questions and run '
+                      'gold SQL on, by default the one attached by the '
+                      'program.')
+  parser.add_argument('--repeat', type=int, default=1,
+                      help='Times to answer the questions, e.g. to see '
+                      'effect of caches.')
+  parser.add_argument('--set', action='append', default=[],
+                      metavar='FIELD=JSON', help='Overrides field of config.')
+  args = parser.parse_args()
+  config = logiclm.LoadConfig(args.config)
+  config.setdefault('log_level', 'warning')
+  for assignment in args.set:
+    field, value = assignment.split('=', 1)
+    config[field] = json.loads(value)
+  database = args.database or Database(config)
+  if not os.path.exists(database):
+    parser.error('Database %s does not exist, get it from the Spider '
+                 'dataset, see docstring of benchmark.py.' % database)
+  questions = ReadQuestions(args.questions)
+  with tempfile.TemporaryDirectory() as directory:
+    if args.database:
+      config = WithDatabase(config, os.path.abspath(database), directory)
+    started_at = time.time()
+    passes = Run(config, questions, database, args.repeat)
+    Report(passes)
+    print('Benchmark took %.2f seconds.' % (time.time() - started_at))
+
+
+if __name__ == '__main__':
+  main()
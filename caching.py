@@ -0,0 +1,172 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Caching and coalescing of server computations."""
+
+import collections
+import copy
+import hashlib
+import json
+import threading
+
+
+def RequestKey(request):
+  """Canonical hash of a JSON request or a prompt."""
+  if not isinstance(request, str):
+    request = json.dumps(request, sort_keys=True)
+  return hashlib.sha256(request.encode()).hexdigest()
+
+
+class Flight:
+  """Computation shared by all concurrent callers with the same key."""
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.done = threading.Event()
+    self.waiters = 0
+    self.abandoned = False
+    self.on_abandoned = None
+    self.result = None
+    self.error = None
+
+  def OnAbandoned(self, callback):
+    """Sets callback to call when every waiter has left."""
+    self.on_abandoned = callback
+
+  def Leave(self):
+    """Called when a waiter is no longer interested in the result."""
+    with self.lock:
+      self.waiters -= 1
+      abandoned = self.waiters == 0 and not self.done.is_set()
+      self.abandoned = self.abandoned or abandoned
+    if abandoned and self.on_abandoned:
+      self.on_abandoned()
+
+  def Result(self):
+    self.done.wait()
+    if self.error:
+      raise self.error
+    return copy.deepcopy(self.result)
+
+
+class SingleFlight:
+  """Coalesces concurrent identical computations into one.
+
+  First caller with a key becomes the leader and runs the computation, others
+  wait for it and get copies of its result. Results are not kept once the
+  computation completes.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.flights = {}
+
+  def Join(self, key):
+    """Returns flight of the key and whether caller is its leader."""
+    with self.lock:
+      flight = self.flights.get(key)
+      # Abandoned flight may be cancelled, so newcomers start over.
+      leader = flight is None or flight.abandoned
+      if leader:
+        flight = self.flights[key] = Flight()
+    with flight.lock:
+      flight.waiters += 1
+    return flight, leader
+
+  def Fly(self, key, flight, compute):
+    """Runs computation of the flight. Called by the leader."""
+    try:
+      flight.result = compute()
+    except Exception as e:
+      flight.error = e
+    finally:
+      with self.lock:
+        if self.flights.get(key) is flight:
+          del self.flights[key]
+      flight.done.set()
+
+  def Do(self, key, compute):
+    flight, leader = self.Join(key)
+    if leader:
+      self.Fly(key, flight, compute)
+    return flight.Result()
+
+
+class BoundedCache:
+  """Least recently used cache, which keeps values within a memory budget.
+
+  Sizes of values are estimated by the callers, e.g. as length of the
+  programs they hold, so the budget is approximate.
+  """
+  def __init__(self, budget_bytes):
+    self.budget_bytes = budget_bytes
+    self.lock = threading.Lock()
+    self.entries = collections.OrderedDict()
+    self.size_bytes = 0
+
+  def Get(self, key):
+    """Returns value of the key or None."""
+    with self.lock:
+      if key not in self.entries:
+        return None
+      self.entries.move_to_end(key)
+      value, _ = self.entries[key]
+      return value
+
+  def Put(self, key, value, size_bytes):
+    """Keeps the value, values over the budget are not kept.
+
+    Previous value of the key is dropped either way, so it is never served
+    in place of the new one.
+    """
+    with self.lock:
+      if key in self.entries:
+        self.size_bytes -= self.entries.pop(key)[1]
+      if size_bytes > self.budget_bytes:
+        return
+      self.entries[key] = (value, size_bytes)
+      self.size_bytes += size_bytes
+      while self.size_bytes > self.budget_bytes:
+        _, (_, evicted_size) = self.entries.popitem(last=False)
+        self.size_bytes -= evicted_size
+
+  def Invalidate(self, is_stale):
+    """Drops entries for which is_stale(key, value) holds, returns count."""
+    with self.lock:
+      stale = [k for k, (v, _) in self.entries.items() if is_stale(k, v)]
+      for k in stale:
+        self.size_bytes -= self.entries.pop(k)[1]
+    return len(stale)
+
+  def Rekey(self, new_key):
+    """Replaces key of each entry with new_key(key, value).
+
+    Entries for which new_key returns None are dropped, returns their count.
+    """
+    with self.lock:
+      entries = collections.OrderedDict()
+      for k, (v, size) in self.entries.items():
+        k = new_key(k, v)
+        if k is None:
+          self.size_bytes -= size
+        else:
+          entries[k] = (v, size)
+      dropped = len(self.entries) - len(entries)
+      self.entries = entries
+    return dropped
+
+  def Clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.size_bytes = 0
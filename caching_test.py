@@ -0,0 +1,149 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of caching."""
+
+import threading
+import time
+import unittest
+
+import caching
+
+
+class SingleFlightTest(unittest.TestCase):
+
+  def testConcurrentIdenticalComputationsRunOnce(self):
+    flights = caching.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def Compute():
+      calls.append(1)
+      started.set()
+      release.wait()
+      return {'rows': [1, 2]}
+    results = []
+    def Request():
+      results.append(flights.Do('key', Compute))
+    leader = threading.Thread(target=Request)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=Request)
+    follower.start()
+    # Follower has joined the flight once there are two waiters.
+    flight = flights.flights['key']
+    while flight.waiters < 2:
+      time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(results, [{'rows': [1, 2]}, {'rows': [1, 2]}])
+    # Each waiter gets a copy of its own.
+    self.assertIsNot(results[0], results[1])
+
+  def testFlightIsNotKeptAfterCompletion(self):
+    flights = caching.SingleFlight()
+    self.assertEqual(flights.Do('key', lambda: 1), 1)
+    self.assertEqual(flights.Do('key', lambda: 2), 2)
+
+  def testErrorIsRaisedToEveryWaiter(self):
+    flights = caching.SingleFlight()
+    def Fail():
+      raise ValueError('failed')
+    with self.assertRaises(ValueError):
+      flights.Do('key', Fail)
+
+  def testAbandonedFlightIsCancelledAndNotJoined(self):
+    flights = caching.SingleFlight()
+    cancelled = []
+    flight, leader = flights.Join('key')
+    flight.OnAbandoned(lambda: cancelled.append(True))
+    self.assertTrue(leader)
+    same_flight, follower_is_leader = flights.Join('key')
+    self.assertIs(same_flight, flight)
+    self.assertFalse(follower_is_leader)
+    flight.Leave()
+    self.assertEqual(cancelled, [])
+    flight.Leave()
+    self.assertEqual(cancelled, [True])
+    # Newcomer does not wait for the cancelled computation.
+    new_flight, new_leader = flights.Join('key')
+    self.assertIsNot(new_flight, flight)
+    self.assertTrue(new_leader)
+
+  def testCompletedFlightIsNotAbandoned(self):
+    flights = caching.SingleFlight()
+    cancelled = []
+    flight, unused_leader = flights.Join('key')
+    flight.OnAbandoned(lambda: cancelled.append(True))
+    flights.Fly('key', flight, lambda: 1)
+    flight.Leave()
+    self.assertEqual(cancelled, [])
+
+
+class BoundedCacheTest(unittest.TestCase):
+
+  def testLeastRecentlyUsedIsEvicted(self):
+    cache = caching.BoundedCache(30)
+    cache.Put('a', 1, 10)
+    cache.Put('b', 2, 10)
+    cache.Put('c', 3, 10)
+    self.assertEqual(cache.Get('a'), 1)
+    cache.Put('d', 4, 10)
+    self.assertIsNone(cache.Get('b'))
+    self.assertEqual([cache.Get(k) for k in 'acd'], [1, 3, 4])
+    self.assertEqual(cache.size_bytes, 30)
+
+  def testPutReplacesValue(self):
+    cache = caching.BoundedCache(30)
+    cache.Put('a', 1, 10)
+    cache.Put('a', 2, 20)
+    self.assertEqual(cache.Get('a'), 2)
+    self.assertEqual(cache.size_bytes, 20)
+
+  def testOverBudgetPutDropsPreviousValue(self):
+    cache = caching.BoundedCache(30)
+    cache.Put('a', 'placeholder', 0)
+    cache.Put('b', 2, 10)
+    cache.Put('a', 'large', 31)
+    self.assertIsNone(cache.Get('a'))
+    self.assertEqual(cache.Get('b'), 2)
+    self.assertEqual(cache.size_bytes, 10)
+
+  def testInvalidate(self):
+    cache = caching.BoundedCache(100)
+    for i in range(4):
+      cache.Put(i, i * 10, 10)
+    self.assertEqual(cache.Invalidate(lambda k, v: k % 2 == 0), 2)
+    self.assertEqual([cache.Get(i) for i in range(4)], [None, 10, None, 30])
+    self.assertEqual(cache.size_bytes, 20)
+
+  def testRekey(self):
+    cache = caching.BoundedCache(100)
+    cache.Put(('report', 0, 'x'), 1, 10)
+    cache.Put(('report', 0, 'y'), 2, 10)
+    dropped = cache.Rekey(
+      lambda k, v: None if k[2] == 'y' else ('report', 1, k[2]))
+    self.assertEqual(dropped, 1)
+    self.assertEqual(cache.Get(('report', 1, 'x')), 1)
+    self.assertIsNone(cache.Get(('report', 0, 'x')))
+    self.assertEqual(cache.size_bytes, 10)
+
+
+if __name__ == '__main__':
+  unittest.main()
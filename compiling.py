@@ -0,0 +1,157 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compilation of reports, in the server process or in worker processes.
+
+Parsing, type inference and SQL generation are pure Python, so threads of
+the server compile one at a time. CompilePool compiles in long-lived worker
+processes instead, each of them with the base program of the config parsed
+once. Workers send back executions of the report along with its SQL, so the
+server runs them without compiling the program again.
+"""
+
+import functools
+import io
+import multiprocessing
+from concurrent import futures
+
+import execution
+import olap
+
+from logica.common import color
+from logica.compiler import rule_translate
+from logica.compiler import universe
+from logica.parser_py import parse
+from logica.type_inference.research import infer
+
+
+@functools.lru_cache(maxsize=16)
+def ParsedRules(program_text):
+  """Rules of the program, parsed once per version of its text."""
+  return parse.ParseFile(program_text)['rule']
+
+
+def ExecutedPredicateGroups(o):
+  """Predicates that the server runs together, in groups."""
+  groups = [['Report']]
+  if (o.config.get('parallel_execution') and
+      len(o.MeasureTablePredicates()) > 1):
+    groups.append(o.MeasureTablePredicates())
+  return groups
+
+
+def Compile(o):
+  """Builds logic program, SQL and executions of the Olap.
+
+  Returns logic program, SQL, list of program and executions of each group of
+  ExecutedPredicateGroups, and in case of failure its description and the
+  message to show to the user.
+  """
+  base_program = o.BaseProgram()
+  try:
+    report_program = str(o.GetLogicProgram())
+    logic_program = base_program + ';\n' + report_program
+    rules = ParsedRules(base_program) + parse.ParseFile(report_program)['rule']
+  except parse.ParsingException as e:
+    return None, None, None, 'Failure of parsing.', ErrorMessage(e)
+  try:
+    program = universe.LogicaProgram(rules)
+    sql = program.FormattedPredicateSql('Report')
+    compiled = [(program, {'Report': program.execution})]
+    for predicates in ExecutedPredicateGroups(o)[1:]:
+      compiled.append((program, execution.BuildExecutions(program,
+                                                          predicates)))
+  except parse.ParsingException as e:
+    return (logic_program, None, None,
+            'Failure of parsing when building SQL.', ErrorMessage(e))
+  except rule_translate.RuleCompileException as e:
+    return (logic_program, None, None,
+            'Failure of compilation when building SQL.', ErrorMessage(e))
+  except infer.TypeErrorCaughtException as e:
+    return (logic_program, None, None,
+            'Failure of typing when building SQL.', ErrorMessage(e))
+  return logic_program, sql, compiled, None, None
+
+
+def UseHtmlColors():
+  """Makes error messages highlight with HTML, to be shown on the page."""
+  color.CHR_ERROR = '<span style="color:red;">'
+  color.CHR_END = '</span>'
+  color.CHR_WARNING = '<span style="font-weight: bold">'
+  color.CHR_UNDERLINE = '<span style="font-weight: bold;">'
+
+
+def ErrorMessage(e):
+  s = io.StringIO()
+  e.ShowMessage(stream=s)
+  return s.getvalue()
+
+
+# Config of the worker process.
+worker_config = None
+
+
+def InitializeWorker(config):
+  global worker_config
+  worker_config = config
+  UseHtmlColors()
+  olap.ValidateConfig(config)
+  ParsedRules(olap.BaseProgram(config))
+
+
+def CompileInWorker(json_request):
+  return Compile(olap.Olap(worker_config, json_request))
+
+
+class CompilePool:
+  """Worker processes compiling reports of the config.
+
+  Args:
+    config: Config of the reports.
+    max_workers: Number of worker processes.
+  """
+  def __init__(self, config, max_workers):
+    self.config = config
+    self.max_workers = max_workers
+    # Server has threads running, so workers are spawned rather than forked.
+    self.executor = futures.ProcessPoolExecutor(
+      max_workers=max_workers,
+      mp_context=multiprocessing.get_context('spawn'),
+      initializer=InitializeWorker, initargs=(config,))
+
+  @classmethod
+  def ForConfig(cls, config):
+    """Pool of compile_workers processes, or None if config does not ask."""
+    max_workers = config.get('compile_workers')
+    if not max_workers:
+      return None
+    return cls(config, max_workers)
+
+  def Compile(self, json_request):
+    """Like Compile, building Olap of the request in a worker.
+
+    Returns None if the pool was shut down, e.g. by a reload of the config.
+    """
+    try:
+      future = self.executor.submit(CompileInWorker, json_request)
+    except futures.process.BrokenProcessPool:
+      raise
+    except RuntimeError:
+      return None
+    return future.result()
+
+  def Shutdown(self):
+    self.executor.shutdown(wait=False)
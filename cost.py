@@ -0,0 +1,161 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Estimation of cost of a report before running it.
+
+Estimate combines row counts of the fact tables the report reads with the
+plan that the engine builds for the report query. Engines that estimate
+cardinality (duckdb, psql) report it in their plan directly. SQLite plan has
+no cardinality, so each loop over a virtual table (which is how ranges and
+lists expand facts) is assumed to go through fan-out rows for each fact.
+"""
+
+import re
+import threading
+import time
+
+import execution
+
+from logica.tools import avatar
+
+
+DEFAULT_FAN_OUT = 10
+
+
+class CostEstimate:
+  def __init__(self, rows, fact_rows, plan):
+    self.rows = rows
+    self.fact_rows = fact_rows
+    self.plan = plan
+
+  def __str__(self):
+    return 'CostEstimate(rows=%d, fact_rows=%d)' % (self.rows, self.fact_rows)
+
+
+class FactTableStatistics:
+  """Row counts of fact tables, collected lazily and kept for a while."""
+  def __init__(self, time_to_live_seconds=3600):
+    self.time_to_live_seconds = time_to_live_seconds
+    self.lock = threading.Lock()
+    self.rows = {}
+
+  def Rows(self, base_program, fact_table, cancellation=None, pool=None,
+           cache=None):
+    with self.lock:
+      if fact_table in self.rows:
+        rows, collected_at = self.rows[fact_table]
+        if time.time() - collected_at < self.time_to_live_seconds:
+          return rows
+    rows = CountFacts(base_program, fact_table, cancellation, pool, cache)
+    with self.lock:
+      self.rows[fact_table] = (rows, time.time())
+    return rows
+
+  def Invalidate(self, is_stale):
+    """Forgets row counts of fact tables for which is_stale holds."""
+    with self.lock:
+      self.rows = {t: r for t, r in self.rows.items() if not is_stale(t)}
+
+
+def CountFacts(base_program, fact_table, cancellation=None, pool=None,
+               cache=None):
+  rows_predicate = 'LogicLMFactTableRows'
+  rule = +avatar.Predicate(rows_predicate)(
+    rows=avatar.Aggregation('Sum', avatar.Literal(1))) << (
+      avatar.Predicate(fact_table)(avatar.Variable('fact')))
+  program = base_program + ';\n' + str(rule)
+  _, rows = execution.RunPredicate(program, rows_predicate, cancellation,
+                                   pool, cache)
+  return (rows and rows[0][0]) or 0
+
+
+def ExplainPrefix(engine):
+  return {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'duckdb': 'EXPLAIN ',
+    'psql': 'EXPLAIN (FORMAT JSON) '
+  }.get(engine)
+
+
+def ExplainReport(logic_program, cancellation=None, pool=None, cache=None):
+  """Returns engine and plan of Report query, or None if it can't explain.
+
+  Executions of the program are taken from the cache, where the compilation
+  of the report put them, and the plan is fetched on a connection of the
+  pool.
+  """
+  program, executions = execution.CompileExecutions(logic_program, ['Report'],
+                                                    cache)
+  report_execution = executions['Report']
+  engine = program.annotations.Engine()
+  prefix = ExplainPrefix(engine)
+  if not prefix or list(report_execution.table_to_export_map) != ['Report']:
+    # Intermediate tables would have to be built to explain the query.
+    return engine, None
+  sql = (report_execution.PredicateSpecificPreamble('Report') +
+         report_execution.table_to_export_map['Report'])
+  with execution.Runner(program, report_execution.preamble, cancellation,
+                        pool) as runner:
+    if report_execution.preamble:
+      runner(report_execution.preamble, engine, is_final=False)
+    _, rows = runner(prefix + sql, engine, is_final=True)
+  return engine, rows
+
+
+def PlanRows(engine, plan, fact_rows, fan_out):
+  """Number of rows the plan is expected to go through."""
+  if engine == 'psql':
+    plan_text = str(plan)
+    return max(map(float, re.findall(r"'Plan Rows': (\d+)", plan_text)),
+               default=0)
+  if engine == 'duckdb':
+    plan_text = '\n'.join(str(cell) for row in plan for cell in row)
+    estimates = re.findall(r'~(\d+)', plan_text) + re.findall(
+      r'EC: (\d+)', plan_text)
+    return max(map(int, estimates), default=0)
+  if engine == 'sqlite':
+    details = [row[-1] for row in plan]
+    virtual_scans = [d for d in details if 'VIRTUAL TABLE' in d]
+    return fact_rows * (1 + fan_out * len(virtual_scans))
+  return 0
+
+
+def EstimateCost(o, logic_program, statistics, fan_out=DEFAULT_FAN_OUT,
+                 cancellation=None, pool=None, cache=None):
+  """Estimates number of rows the report is going to process.
+
+  Args:
+    o: Olap object of the report.
+    logic_program: Full logic program of the report.
+    statistics: FactTableStatistics of the config.
+    fan_out: Expected number of rows each fact expands to in a SQLite loop
+      over virtual table.
+    cancellation: Cancellation of the queries, e.g. by the request deadline.
+    pool: ConnectionPool to run the queries on.
+    cache: BoundedCache of compiled executions.
+
+  Returns:
+    CostEstimate.
+  """
+  base_program = o.BaseProgram()
+  fact_rows = sum(statistics.Rows(base_program, t, cancellation, pool, cache)
+                  for t in o.relevant_fact_tables
+                  if t not in o.direct_dependency)
+  engine, plan = ExplainReport(logic_program, cancellation, pool, cache)
+  rows = fact_rows
+  if plan is not None:
+    rows = max(rows, PlanRows(engine, plan, fact_rows, fan_out))
+  return CostEstimate(int(rows), fact_rows, plan)
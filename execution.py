@@ -0,0 +1,351 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Execution of compiled OLAP programs."""
+
+import contextlib
+import os
+import sqlite3
+import threading
+from concurrent import futures
+
+from logica.common import concertina_lib
+from logica.common import duckdb_logica
+from logica.common import psql_logica
+from logica.common import sqlite3_logica
+from logica.compiler import universe
+from logica.parser_py import parse
+from logica.tools import run_in_terminal
+
+
+class QueryCancelled(Exception):
+  """Raised when a running query was cancelled."""
+
+
+class Cancellation:
+  """Interrupts queries running on the registered connections.
+
+  Connections are registered by the runners executing the queries. Cancel
+  can be called from any thread, e.g. by a deadline timer or when the client
+  that requested the report has gone away.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.connections = []
+    self.reason = None
+
+  def Register(self, engine, connection):
+    with self.lock:
+      self.connections.append((engine, connection))
+      if self.reason:
+        Interrupt(engine, connection)
+
+  def Unregister(self, connection):
+    with self.lock:
+      self.connections = [(e, c) for e, c in self.connections
+                          if c is not connection]
+
+  def Cancel(self, reason):
+    with self.lock:
+      if self.reason:
+        return
+      self.reason = reason
+      for engine, connection in self.connections:
+        Interrupt(engine, connection)
+
+  def CancelAfter(self, seconds):
+    """Starts timer cancelling the queries. Caller should cancel the timer."""
+    timer = threading.Timer(
+      seconds, self.Cancel,
+      args=('Query exceeded time limit of %s seconds.' % seconds,))
+    timer.daemon = True
+    timer.start()
+    return timer
+
+  def CheckNotCancelled(self):
+    if self.reason:
+      raise QueryCancelled(self.reason)
+
+
+def Interrupt(engine, connection):
+  if connection is None:
+    return
+  if engine in ['sqlite', 'duckdb']:
+    connection.interrupt()
+  elif engine == 'psql':
+    connection.cancel()
+
+
+def ArrowAvailable():
+  try:
+    import pyarrow
+  except ImportError:
+    return False
+  return True
+
+
+def FetchArrow(connection, sql):
+  """Runs query on duckdb connection, fetching result as Arrow table."""
+  relation = connection.sql(sql)
+  if hasattr(relation, 'to_arrow_table'):
+    return relation.columns, relation.to_arrow_table()
+  return relation.columns, relation.arrow()
+
+
+def ArrowRows(table):
+  """Rows of the Arrow table, as duckdb would fetch them.
+
+  Conversion goes column by column, numeric columns without nulls go through
+  numpy. Arrow holds duckdb HUGEINT, e.g. sums of integers, as decimals with
+  zero scale, those are converted to int.
+  """
+  import pyarrow
+  columns = []
+  for column in table.columns:
+    if ((pyarrow.types.is_integer(column.type) or
+         pyarrow.types.is_floating(column.type)) and column.null_count == 0):
+      values = column.to_numpy().tolist()
+    else:
+      values = column.to_pylist()
+    if pyarrow.types.is_decimal(column.type) and column.type.scale == 0:
+      values = [v if v is None else int(v) for v in values]
+    columns.append(values)
+  return list(zip(*columns))
+
+
+def Rows(rows):
+  """Rows of the result, which may be held in Arrow table."""
+  if isinstance(rows, list):
+    return rows
+  return ArrowRows(rows)
+
+
+class PooledConnection:
+  """Connection with the preambles that were already run on it."""
+  def __init__(self, engine, connection):
+    self.engine = engine
+    self.connection = connection
+    self.preambles = set()
+
+
+class ConnectionPool:
+  """Idle connections of a config, reused by the queries of its reports.
+
+  Preambles attach databases and define types, which persists on the
+  connection, so they are run once per connection. Connections of queries
+  that failed or were cancelled are closed rather than reused.
+  """
+  def __init__(self, max_idle_connections=4):
+    self.max_idle_connections = max_idle_connections
+    self.lock = threading.Lock()
+    self.idle = {}
+
+  def Acquire(self, engine, logic_program):
+    with self.lock:
+      idle = self.idle.get(engine)
+      if idle:
+        return idle.pop()
+    return PooledConnection(engine, Connect(engine, logic_program))
+
+  def Release(self, pooled):
+    with self.lock:
+      idle = self.idle.setdefault(pooled.engine, [])
+      if len(idle) < self.max_idle_connections:
+        idle.append(pooled)
+        return
+    pooled.connection.close()
+
+  def Discard(self, pooled):
+    try:
+      pooled.connection.close()
+    except Exception:
+      pass
+
+
+def Connect(engine, logic_program):
+  """Opens connection, which may be used by different threads in turn."""
+  if engine == 'sqlite':
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    sqlite3_logica.ExtendConnectionWithLogicaFunctions(connection)
+    return connection
+  if engine == 'duckdb':
+    return duckdb_logica.GetConnection(logic_program)
+  if engine == 'psql':
+    return psql_logica.ConnectToPostgres('environment')
+  raise ValueError('Engine %s does not support pooling.' % engine)
+
+
+class CancellableSqlRunner(run_in_terminal.SqlRunner):
+  """Runner that can be cancelled, optionally on a pooled connection.
+
+  With arrow set, final duckdb results are fetched as Arrow tables, which
+  are converted to rows by Rows only when the response is built.
+  """
+  def __init__(self, engine, logic_program=None, cancellation=None,
+               pooled=None, preamble=None, arrow=False):
+    if pooled:
+      self.engine = engine
+      self.connection = pooled.connection
+      self.bq_credentials, self.bq_project = None, None
+    else:
+      super().__init__(engine, logic_program=logic_program)
+    self.pooled = pooled
+    self.preamble = preamble
+    self.arrow = arrow and engine == 'duckdb'
+    self.cancellation = cancellation or Cancellation()
+    self.cancellation.Register(engine, self.connection)
+
+  def __call__(self, sql, engine, is_final):
+    self.cancellation.CheckNotCancelled()
+    if self.pooled and sql == self.preamble:
+      if sql in self.pooled.preambles:
+        return
+      self.pooled.preambles.add(sql)
+    try:
+      if self.arrow and is_final:
+        return FetchArrow(self.connection, sql)
+      return super().__call__(sql, engine, is_final)
+    except Exception as e:
+      if self.cancellation.reason:
+        raise QueryCancelled(self.cancellation.reason) from e
+      raise
+
+
+def RunPredicate(logic_program, predicate_name, cancellation=None,
+                 pool=None, cache=None, arrow=False):
+  """Runs predicate of the program, returning header and rows.
+
+  With arrow set rows of duckdb programs are returned as Arrow table, use
+  Rows to get them as lists.
+  """
+  program, executions = CompileExecutions(logic_program, [predicate_name],
+                                          cache)
+  return RunExecution(program, executions[predicate_name], cancellation, pool,
+                      arrow)
+
+
+def CompileExecutions(logic_program, predicate_names, cache=None):
+  """Compiles the program once, building execution for each predicate.
+
+  Compiled executions are kept in the cache, if given, since they are only
+  read when running.
+  """
+  compiled = cache and cache.Get(ExecutionsKey(logic_program, predicate_names))
+  if compiled:
+    return compiled
+  rules = parse.ParseFile(logic_program)['rule']
+  program = universe.LogicaProgram(rules)
+  executions = BuildExecutions(program, predicate_names)
+  if cache:
+    CacheExecutions(cache, logic_program, program, executions)
+  return program, executions
+
+
+def ExecutionsKey(logic_program, predicate_names):
+  return ('executions', logic_program, tuple(predicate_names))
+
+
+def BuildExecutions(program, predicate_names):
+  """Executions of the predicates of compiled LogicaProgram."""
+  executions = {}
+  for p in predicate_names:
+    program.FormattedPredicateSql(p)
+    executions[p] = program.execution
+  return executions
+
+
+def CacheExecutions(cache, logic_program, program, executions):
+  """Keeps executions compiled elsewhere, e.g. in a compile worker."""
+  size = len(logic_program) + sum(
+    len(t) for e in executions.values()
+    for t in e.table_to_export_map.values())
+  cache.Put(ExecutionsKey(logic_program, list(executions)),
+            (program, executions), size)
+
+
+@contextlib.contextmanager
+def Runner(program, preamble=None, cancellation=None, pool=None,
+           arrow=False):
+  """Runner on a connection from the pool or on its own one.
+
+  Pooled connection is released when the runner is done, or closed if it
+  failed. Connection of its own is closed.
+  """
+  engine = program.annotations.Engine()
+  if pool is None or engine == 'bigquery':
+    runner = CancellableSqlRunner(engine, logic_program=program,
+                                  cancellation=cancellation, arrow=arrow)
+    try:
+      yield runner
+    finally:
+      runner.cancellation.Unregister(runner.connection)
+      if runner.connection is not None:
+        runner.connection.close()
+    return
+  pooled = pool.Acquire(engine, program)
+  runner = CancellableSqlRunner(engine, cancellation=cancellation,
+                                pooled=pooled, preamble=preamble, arrow=arrow)
+  try:
+    yield runner
+  except BaseException:
+    runner.cancellation.Unregister(pooled.connection)
+    pool.Discard(pooled)
+    raise
+  runner.cancellation.Unregister(pooled.connection)
+  pool.Release(pooled)
+
+
+def RunExecution(program, execution, cancellation=None, pool=None,
+                 arrow=False):
+  """Runs execution on a connection from the pool or on its own one."""
+  engine = program.annotations.Engine()
+  with Runner(program, execution.preamble, cancellation, pool,
+              arrow) as runner:
+    result = concertina_lib.ExecuteLogicaProgram(
+      [execution], runner, engine, display_mode='silent')
+  return result[execution.main_predicate]
+
+
+def RunInParallel(o, logic_program, max_workers=None, cancellation=None,
+                  pool=None, cache=None, arrow=False):
+  """Runs each measure table of the Olap on a separate connection.
+
+  Per-table aggregations are executed concurrently and then joined on
+  dimension columns in-process.
+
+  Args:
+    o: Olap object, which logic program was already built.
+    logic_program: Full logic program of the Olap.
+    max_workers: Maximum number of concurrently running queries.
+    cancellation: Cancellation interrupting all of the queries.
+    pool: ConnectionPool to take connections from.
+    cache: BoundedCache of compiled executions.
+    arrow: Whether to fetch duckdb results as Arrow tables.
+
+  Returns:
+    Header and rows of the report.
+  """
+  predicates = o.MeasureTablePredicates()
+  program, executions = CompileExecutions(logic_program, predicates, cache)
+  max_workers = max_workers or min(len(predicates), os.cpu_count() or 1)
+  with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+    results = executor.map(
+      lambda p: RunExecution(program, executions[p], cancellation, pool,
+                             arrow),
+      predicates)
+    parts = {p: (header, Rows(rows))
+             for p, (header, rows) in zip(predicates, results)}
+  return o.AssembleReport(parts)
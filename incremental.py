@@ -0,0 +1,409 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incrementally refreshed aggregates of append-only fact tables.
+
+Fact table of the config can declare a watermark, e.g. the date of events,
+that only grows as facts are appended:
+  {"fact_table": "Event",
+   "incremental": {"watermark": "fact.date",
+                   "cumulative_dimensions": {"CumulativeDate": "end_date"}}}
+and measures can declare how partial aggregates of them merge:
+  {"aggregating_function": {"predicate_name": "Impressions"},
+   "mergeable": {"kind": "sum"}}
+  {"aggregating_function": {"predicate_name": "Reach"},
+   "mergeable": {"kind": "count_distinct", "value": "fact.person",
+                 "factor": "SamplingRate()"}}
+Aggregates of a report are kept per watermark value, along with the number
+of facts of each. Before a report is computed facts at or after the highest
+watermark seen are counted. If there are new watermarks, or more facts at
+the highest one, only those facts are aggregated again and merged with the
+kept aggregates. Distinct counts are kept as HyperLogLog sketches, built
+with numpy, so they are approximate.
+
+Cumulative dimension, e.g. CumulativeDate(end_date:), is a date that
+counts facts of the watermark date and of all dates before it, up to the
+end date parameter. It is computed by merging aggregates of the earlier
+dates, without reading the history again.
+"""
+
+import datetime
+import json
+import threading
+
+import caching
+import execution
+import inmemory
+import olap
+
+from logica.tools import avatar
+
+
+SUMS_PREDICATE = 'LogicLMIncrementalSums'
+VALUES_PREDICATE = 'LogicLMIncrementalValues'
+CHECK_PREDICATE = 'LogicLMIncrementalCheck'
+
+
+def Numpy():
+  try:
+    import numpy
+    import pandas
+  except ImportError:
+    return None
+  return numpy
+
+
+class HyperLogLog:
+  """Mergeable sketch of the number of distinct values."""
+  def __init__(self, registers):
+    self.registers = registers
+
+  def Merge(self, other):
+    return HyperLogLog(Numpy().maximum(self.registers, other.registers))
+
+  def Estimate(self):
+    numpy = Numpy()
+    m = len(self.registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / numpy.sum(
+      numpy.ldexp(1.0, -self.registers.astype(numpy.int32)))
+    zeros = int(numpy.count_nonzero(self.registers == 0))
+    # Linear counting is more accurate for small sets.
+    if estimate <= 2.5 * m and zeros:
+      return m * numpy.log(m / zeros)
+    return float(estimate)
+
+
+def Sketches(keys, values, precision):
+  """HyperLogLog sketch of the values of each key.
+
+  Values are hashed and placed into registers with numpy, rather than one
+  by one.
+  """
+  numpy = Numpy()
+  import pandas
+  codes = {}
+  key_codes = numpy.fromiter((codes.setdefault(k, len(codes)) for k in keys),
+                             numpy.int64, len(keys))
+  # Values are hashed as strings, so a value hashes the same way whatever
+  # the type of the column it was fetched in.
+  hashes = pandas.util.hash_array(
+    pandas.Series(values, dtype=object).astype(str).to_numpy())
+  bits = 64 - precision
+  index = (hashes >> numpy.uint64(bits)).astype(numpy.int64)
+  rest = hashes & numpy.uint64((1 << bits) - 1)
+  length = numpy.zeros(len(rest), numpy.int64)
+  nonzero = rest > 0
+  length[nonzero] = numpy.floor(
+    numpy.log2(rest[nonzero].astype(numpy.float64))).astype(numpy.int64) + 1
+  rank = (bits - length + 1).astype(numpy.uint8)
+  registers = numpy.zeros((len(codes), 1 << precision), numpy.uint8)
+  numpy.maximum.at(registers, (key_codes, index), rank)
+  return {k: HyperLogLog(registers[c]) for k, c in codes.items()}
+
+
+def IncrementalFactTables(config):
+  """Incremental specs of fact tables, by fact table."""
+  return {t['fact_table']: t['incremental']
+          for t in config['fact_tables'] if 'incremental' in t}
+
+
+def Merge(kind, a, b):
+  if a is None:
+    return b
+  if b is None:
+    return a
+  if kind == 'sum':
+    return a + b
+  return a.Merge(b)
+
+
+def Dates(first, last):
+  """ISO dates from first to last, inclusive."""
+  try:
+    first = datetime.date.fromisoformat(str(first))
+    last = datetime.date.fromisoformat(str(last))
+  except ValueError as e:
+    raise inmemory.UnsupportedReport(
+      'Cumulative dimension needs ISO dates: %s' % e)
+  return [(first + datetime.timedelta(days=i)).isoformat()
+          for i in range((last - first).days + 1)]
+
+
+class Aggregate:
+  """Partial aggregates of a report by watermark and dimensions."""
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.partitions = {}
+    # Number of facts of each watermark.
+    self.facts = {}
+    self.high_watermark = None
+    # Factors of distinct counts, by measure, e.g. the sampling rate.
+    self.factors = {}
+
+  def SizeBytes(self):
+    size = 0
+    for groups in self.partitions.values():
+      for states in groups.values():
+        size += 100 + sum(s.registers.nbytes if isinstance(s, HyperLogLog)
+                          else 8 for s in states)
+    return size
+
+
+class IncrementalEngine:
+  """Computes reports of mergeable measures from kept partial aggregates.
+
+  Args:
+    config: Config with incremental fact tables.
+  """
+  def __init__(self, config):
+    self.config = config
+    self.fact_tables = IncrementalFactTables(config)
+    self.mergeable = {m['aggregating_function']['predicate_name']:
+                      m['mergeable']
+                      for m in config['measures'] if 'mergeable' in m}
+    self.precision = config.get('sketch_precision', 12)
+    self.aggregates = caching.BoundedCache(
+      config.get('incremental_cache_megabytes', 64) * 2**20)
+    self.lock = threading.Lock()
+
+  def AdoptAggregates(self, engine, is_stale):
+    """Takes aggregates of engine of previous version of the config.
+
+    Args:
+      engine: Engine of previous version of the config.
+      is_stale: Function telling whether aggregates over the given predicates
+        are affected by the change of the config.
+    """
+    def Predicates(key):
+      fact_table, *calls = key
+      return [fact_table] + [olap.CalledPredicate(c)
+                             for group in calls for c in group]
+    with engine.aggregates.lock:
+      entries = list(engine.aggregates.entries.items())
+    for key, (aggregate, size_bytes) in entries:
+      if not is_stale(Predicates(key)):
+        self.aggregates.Put(key, aggregate, size_bytes)
+
+  def Kind(self, o, measure):
+    return self.mergeable[o.CalledPredicate(measure)]['kind']
+
+  def Plan(self, o):
+    """Fact table, cumulative dimension and its end date of the report.
+
+    Raises inmemory.UnsupportedReport if the report can't be computed from
+    partial aggregates.
+    """
+    if (o.preview or len(o.relevant_fact_tables) != 1 or
+        len(o.MeasureTablePredicates()) != 1):
+      raise inmemory.UnsupportedReport('Report is not over a single table.')
+    [fact_table] = o.relevant_fact_tables
+    if fact_table not in self.fact_tables or fact_table in o.direct_dependency:
+      raise inmemory.UnsupportedReport(
+        'Fact table %s has no watermark.' % fact_table)
+    for m in o.measures:
+      if o.CalledPredicate(m) not in self.mergeable:
+        raise inmemory.UnsupportedReport('Measure %s is not mergeable.' % m)
+      if self.Kind(o, m) == 'count_distinct' and not Numpy():
+        raise inmemory.UnsupportedReport(
+          'Sketches of distinct counts need numpy and pandas.')
+    cumulative_dimensions = self.fact_tables[fact_table].get(
+      'cumulative_dimensions', {})
+    cumulative = [d for d in o.dimensions
+                  if o.CalledPredicate(d) in cumulative_dimensions]
+    if len(cumulative) > 1:
+      raise inmemory.UnsupportedReport('Report has several cumulative '
+                                       'dimensions.')
+    if not cumulative:
+      return fact_table, None, None
+    [d] = cumulative
+    parameter = cumulative_dimensions[o.CalledPredicate(d)]
+    args = o.AsPredicateCall(d).named_args
+    if list(args) != [parameter]:
+      raise inmemory.UnsupportedReport('Dimension %s is not cumulative up '
+                                       'to %s.' % (d, parameter))
+    return fact_table, d, args[parameter].AsJson()
+
+  def FactCall(self, o, call):
+    return str(o.AsPredicateCall(call)(avatar.Variable('fact')))
+
+  def Rule(self, o, fact_table, predicate, dimensions, columns,
+           from_watermark):
+    watermark = self.fact_tables[fact_table]['watermark']
+    args = ['watermark: %s' % watermark]
+    args += ['d_%d: %s' % (i, self.FactCall(o, d))
+             for i, d in enumerate(dimensions)]
+    args += columns
+    body = ['%s(fact)' % fact_table] + [self.FactCall(o, f)
+                                        for f in o.filters]
+    if from_watermark is not None:
+      body.append('%s >= %s' % (watermark, json.dumps(from_watermark)))
+    return '%s(%s) distinct :- %s' % (predicate, ', '.join(args),
+                                      ', '.join(body))
+
+  def Records(self, o, rule, predicate, cancellation, pool, cache=None):
+    header, rows = execution.RunPredicate(
+      o.BaseProgram() + ';\n' + rule, predicate, cancellation=cancellation,
+      pool=pool, cache=cache)
+    # Facts without watermark can't be placed in order, so they are left out.
+    return [r for r in (dict(zip(header, row)) for row in execution.Rows(rows))
+            if r['watermark'] is not None]
+
+  def Appended(self, o, fact_table, aggregate, cancellation, pool, cache):
+    """Whether facts were appended since the aggregate was refreshed."""
+    if aggregate.high_watermark is None:
+      return True
+    # Text of the rule changes only with the watermark, so its compilation
+    # is cached.
+    rule = self.Rule(o, fact_table, CHECK_PREDICATE, [], ['facts? += 1'],
+                     aggregate.high_watermark)
+    records = self.Records(o, rule, CHECK_PREDICATE, cancellation, pool,
+                           cache)
+    return ({r['watermark']: r['facts'] for r in records} !=
+            {aggregate.high_watermark:
+             aggregate.facts[aggregate.high_watermark]})
+
+  def Partitions(self, o, fact_table, dimensions, from_watermark,
+                 cancellation, pool):
+    """Partial aggregates of facts from the watermark on.
+
+    Returns partial aggregates by watermark and dimensions, number of facts
+    by watermark, and factors of distinct counts by measure.
+    """
+    partitions = {}
+    facts = {}
+    factors = {}
+    def State(watermark, key):
+      groups = partitions.setdefault(watermark, {})
+      return groups.setdefault(key, [None] * len(o.measures))
+    def Key(record):
+      return tuple(record['d_%d' % j] for j in range(len(dimensions)))
+    sums = [i for i, m in enumerate(o.measures) if self.Kind(o, m) == 'sum']
+    # Facts are counted along with the sums, so that the counts are never
+    # ahead of the aggregates.
+    rule = self.Rule(o, fact_table, SUMS_PREDICATE, dimensions,
+                     ['m_%d? Aggr= %s' % (i, self.FactCall(o, o.measures[i]))
+                      for i in sums] + ['facts? += 1'], from_watermark)
+    for record in self.Records(o, rule, SUMS_PREDICATE, cancellation, pool):
+      w = record['watermark']
+      facts[w] = facts.get(w, 0) + record['facts']
+      state = State(w, Key(record))
+      for i in sums:
+        state[i] = record['m_%d' % i]
+    for i, m in enumerate(o.measures):
+      spec = self.mergeable[o.CalledPredicate(m)]
+      if spec['kind'] != 'count_distinct':
+        continue
+      columns = ['value: %s' % spec['value']]
+      if spec.get('factor'):
+        columns.append('factor: %s' % spec['factor'])
+      rule = self.Rule(o, fact_table, VALUES_PREDICATE, dimensions, columns,
+                       from_watermark)
+      records = self.Records(o, rule, VALUES_PREDICATE, cancellation, pool)
+      sketches = Sketches([(r['watermark'], Key(r)) for r in records],
+                          [r['value'] for r in records], self.precision)
+      for (w, key), sketch in sketches.items():
+        State(w, key)[i] = sketch
+      if records:
+        factors[i] = records[0].get('factor', 1)
+    return partitions, facts, factors
+
+  def Refresh(self, o, fact_table, dimensions, cancellation, pool, cache):
+    """Aggregate of the report, with facts appended since last refresh."""
+    key = (fact_table, tuple(dimensions), tuple(o.filters),
+           tuple(o.measures))
+    with self.lock:
+      aggregate = self.aggregates.Get(key)
+      if aggregate is None:
+        aggregate = Aggregate()
+        self.aggregates.Put(key, aggregate, 0)
+    with aggregate.lock:
+      if not self.Appended(o, fact_table, aggregate, cancellation, pool,
+                           cache):
+        return aggregate
+      # Facts of the highest watermark could have been appended to, so it
+      # is aggregated again.
+      from_watermark = aggregate.high_watermark
+      partitions, facts, factors = self.Partitions(
+        o, fact_table, dimensions, from_watermark, cancellation, pool)
+      if from_watermark is not None:
+        aggregate.partitions = {w: g for w, g in aggregate.partitions.items()
+                                if w < from_watermark}
+        aggregate.facts = {w: n for w, n in aggregate.facts.items()
+                           if w < from_watermark}
+      aggregate.partitions.update(partitions)
+      aggregate.facts.update(facts)
+      aggregate.factors.update(factors)
+      if aggregate.partitions:
+        aggregate.high_watermark = max(aggregate.partitions)
+      self.aggregates.Put(key, aggregate, aggregate.SizeBytes())
+    return aggregate
+
+  def Value(self, o, aggregate, i, state):
+    if state is None:
+      return None
+    if self.Kind(o, o.measures[i]) == 'sum':
+      return state
+    return round(state.Estimate()) * aggregate.factors.get(i, 1)
+
+  def Accumulate(self, o, merged, groups):
+    """Merges states of the groups into merged, by dimensions."""
+    kinds = [self.Kind(o, m) for m in o.measures]
+    for key, states in groups.items():
+      current = merged.get(key, [None] * len(kinds))
+      merged[key] = [Merge(k, a, b) for k, a, b in zip(kinds, current, states)]
+
+  def Run(self, o, cancellation=None, pool=None, cache=None):
+    """Header and rows of the report, and whether they are approximate.
+
+    Queries run with the cancellation, on connections of the pool, and
+    compilation of the check of appended facts is kept in the cache.
+    Raises inmemory.UnsupportedReport if the report needs to go through SQL.
+    """
+    cancellation = cancellation or execution.Cancellation()
+    fact_table, cumulative, end = self.Plan(o)
+    dimensions = [d for d in o.dimensions if d != cumulative]
+    aggregate = self.Refresh(o, fact_table, dimensions, cancellation, pool,
+                             cache)
+    with aggregate.lock:
+      watermarks = sorted(aggregate.partitions)
+      rows = []
+      def Row(key, states, cumulative_value=None):
+        values = dict(zip(dimensions, key))
+        if cumulative:
+          values[cumulative] = cumulative_value
+        return ([values[d] for d in o.dimensions] +
+                [self.Value(o, aggregate, i, s) for i, s in enumerate(states)])
+      if not cumulative:
+        merged = {}
+        for w in watermarks:
+          cancellation.CheckNotCancelled()
+          self.Accumulate(o, merged, aggregate.partitions[w])
+        rows = [Row(key, states) for key, states in merged.items()]
+      elif watermarks:
+        # Facts count towards their date and each date after it.
+        running = {}
+        remaining = list(watermarks)
+        for date in Dates(watermarks[0], end):
+          cancellation.CheckNotCancelled()
+          while remaining and remaining[0] <= date:
+            self.Accumulate(o, running, aggregate.partitions[remaining.pop(0)])
+          rows.extend(Row(key, states, date)
+                      for key, states in running.items())
+    header = [o.ColumnName(c) for c in o.dimensions + o.measures]
+    [predicate] = o.MeasureTablePredicates()
+    approximate = any(self.Kind(o, m) == 'count_distinct' for m in o.measures)
+    return o.AssembleReport({predicate: (header, rows)}), approximate
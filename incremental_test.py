@@ -0,0 +1,195 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of incremental, comparing its reports to ones of SQL."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import ai
+import execution
+import incremental
+import inmemory
+import olap
+import server
+
+
+PROGRAM = '''
+@Engine("sqlite");
+@AttachDatabase("db", "%s");
+
+Event({date:, region:, person:, amount:}) :-
+  db.Event(date:, region:, person:, amount:);
+
+Amount(fact) = Sum(fact.amount);
+NumEvents(fact) = Sum(1);
+People(fact) = Count(fact.person);
+AverageAmount(fact) = Avg(fact.amount);
+
+Region(fact) = fact.region;
+EventDate(fact) = fact.date;
+CumulativeDate(fact, end_date:) = DateAddDay(fact.date, i) :-
+  i in Range(DateDiffDay(end_date, fact.date) + 1);
+'''
+
+
+def Predicate(name):
+  return {'predicate_name': name, 'parameters': []}
+
+
+def Config(program_path):
+  return {
+    'name': 'Events',
+    'fact_tables': [{
+      'fact_table': 'Event',
+      'incremental': {'watermark': 'fact.date',
+                      'cumulative_dimensions': {'CumulativeDate': 'end_date'}}
+    }],
+    'default_fact_table': 'Event',
+    'measures': [
+      {'aggregating_function': Predicate('Amount'),
+       'mergeable': {'kind': 'sum'}},
+      {'aggregating_function': Predicate('NumEvents'),
+       'mergeable': {'kind': 'sum'}},
+      {'aggregating_function': Predicate('People'),
+       'mergeable': {'kind': 'count_distinct', 'value': 'fact.person'}},
+      {'aggregating_function': Predicate('AverageAmount')}],
+    'dimensions': [
+      {'function': Predicate('Region')},
+      {'function': Predicate('EventDate')},
+      {'function': {'predicate_name': 'CumulativeDate',
+                    'parameters': [{'field_name': 'end_date'}]}}],
+    'filters': [],
+    'chart_types': [{'predicate': Predicate('Table')}],
+    'logica_program': program_path,
+    'dashboard': {},
+    'suffix_lines': [],
+  }
+
+
+def Request(measures, dimensions):
+  return {'measures': measures, 'dimensions': dimensions, 'filters': [],
+          'order': [], 'limit': -1, 'chartType': 'Table()'}
+
+
+class IncrementalEngineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.database = os.path.join(self.directory, 'events.sqlite')
+    with sqlite3.connect(self.database) as connection:
+      connection.execute(
+        'CREATE TABLE Event (date TEXT, region TEXT, person TEXT, amount INT)')
+    self.Append([('2024-01-01', 'east', 'p%d' % i, i % 7) for i in range(300)])
+    self.Append([('2024-01-02', 'west', 'p%d' % i, 2) for i in range(200)])
+    program_path = os.path.join(self.directory, 'events.l')
+    with open(program_path, 'w') as f:
+      f.write(PROGRAM % self.database)
+    self.config = Config(program_path)
+    self.engine = incremental.IncrementalEngine(self.config)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def Append(self, events):
+    with sqlite3.connect(self.database) as connection:
+      connection.executemany('INSERT INTO Event VALUES (?, ?, ?, ?)', events)
+
+  def Olap(self, request):
+    o = olap.Olap(self.config, request)
+    o.GetLogicProgram()
+    return o
+
+  def SqlReport(self, request):
+    header, rows = execution.RunPredicate(
+      self.Olap(request).GetFullLogicProgram(), 'Report')
+    return header, sorted(map(list, execution.Rows(rows)))
+
+  def IncrementalReport(self, request):
+    (header, rows), approximate = self.engine.Run(self.Olap(request))
+    return (header, sorted(map(list, rows))), approximate
+
+  def Aggregate(self):
+    [(aggregate, _)] = self.engine.aggregates.entries.values()
+    return aggregate
+
+  def testSumsMatchSql(self):
+    request = Request(['Amount()', 'NumEvents()'], ['Region()'])
+    report, approximate = self.IncrementalReport(request)
+    self.assertEqual(report, self.SqlReport(request))
+    self.assertFalse(approximate)
+
+  def testAppendedFactsAdvanceWatermark(self):
+    request = Request(['Amount()', 'NumEvents()'], ['Region()'])
+    self.IncrementalReport(request)
+    self.assertEqual(self.Aggregate().high_watermark, '2024-01-02')
+    # More facts of the highest watermark, and facts of a new one.
+    self.Append([('2024-01-02', 'east', 'q1', 5)])
+    self.Append([('2024-01-03', 'north', 'q2', 7)])
+    report, unused_approximate = self.IncrementalReport(request)
+    self.assertEqual(report, self.SqlReport(request))
+    aggregate = self.Aggregate()
+    self.assertEqual(aggregate.high_watermark, '2024-01-03')
+    self.assertEqual(aggregate.facts,
+                     {'2024-01-01': 300, '2024-01-02': 201, '2024-01-03': 1})
+
+  def testAppendToHighestWatermarkIsDetected(self):
+    request = Request(['NumEvents()'], ['EventDate()'])
+    self.IncrementalReport(request)
+    self.Append([('2024-01-02', 'west', 'q1', 1)])
+    report, unused_approximate = self.IncrementalReport(request)
+    self.assertEqual(report, self.SqlReport(request))
+
+  def testDistinctCountIsApproximate(self):
+    request = Request(['People()', 'NumEvents()'], ['Region()'])
+    (header, rows), approximate = self.IncrementalReport(request)
+    sql_header, sql_rows = self.SqlReport(request)
+    self.assertTrue(approximate)
+    self.assertEqual(header, sql_header)
+    for row, sql_row in zip(rows, sql_rows):
+      self.assertEqual(row[0], sql_row[0])
+      self.assertAlmostEqual(row[1], sql_row[1], delta=sql_row[1] * 0.05)
+      self.assertEqual(row[2], sql_row[2])
+
+  def testDistinctCountMergesAcrossWatermarks(self):
+    # Persons p0..p199 are both in the first and the second date.
+    request = Request(['People()'], ['CumulativeDate(end_date: "2024-01-02")'])
+    (header, rows), unused_approximate = self.IncrementalReport(request)
+    self.assertEqual([r[0] for r in rows], ['2024-01-01', '2024-01-02'])
+    self.assertAlmostEqual(rows[1][1], 300, delta=15)
+
+  def testServerMarksResponseApproximate(self):
+    heart = server.LogicLMServerHeart(
+      dict(self.config, log_level='warning'),
+      ai.RecordedAI.FromTranslations({}))
+    request = Request(['People()'], ['Region()'])
+    heart.RunJson(request)
+    self.assertTrue(request.get('approximate'))
+    request = Request(['Amount()'], ['Region()'])
+    heart.RunJson(request)
+    self.assertFalse(request.get('approximate'))
+
+  def testUnmergeableMeasureRunsSql(self):
+    with self.assertRaises(inmemory.UnsupportedReport):
+      self.engine.Run(self.Olap(Request(['AverageAmount()'], ['Region()'])))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Ingestion of JSON sources into Parquet store.
+
+DuckDB programs read JSON files as `('path/data.jsonl')`, which re-parses the
+file on every query. Here such sources are converted into Parquet files once
+and program is rewritten to read them. Files are re-ingested when the JSON
+source is modified.
+
+Compile workers ingest too, so ingestion of a file is serialized across
+processes with a lock file next to the store, and each conversion writes
+its own temporary file before moving it in place.
+"""
+
+import contextlib
+import os
+import re
+import tempfile
+import threading
+
+
+JSON_SOURCE_PATTERN = re.compile(r"`\('([^']+\.jsonl?)'\)`")
+
+ingestion_lock = threading.Lock()
+
+
+def JsonSources(program):
+  """Returns paths of JSON files the program reads."""
+  return JSON_SOURCE_PATTERN.findall(program)
+
+
+def StorePath(json_path, store_directory=None):
+  store_directory = store_directory or os.path.dirname(json_path)
+  return os.path.join(store_directory,
+                      os.path.basename(json_path) + '.parquet')
+
+
+def IsFresh(json_path, store_path):
+  return (os.path.exists(store_path) and
+          os.path.getmtime(store_path) >= os.path.getmtime(json_path))
+
+
+@contextlib.contextmanager
+def FileLock(path):
+  """Exclusive lock of the path among processes, where fcntl is available."""
+  try:
+    import fcntl
+  except ImportError:
+    yield
+    return
+  with open(path, 'a') as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def IngestJsonSource(json_path, store_directory=None):
+  """Converts JSON file to Parquet, unless it is already fresh."""
+  store_path = StorePath(json_path, store_directory)
+  os.makedirs(os.path.dirname(store_path) or '.', exist_ok=True)
+  with ingestion_lock, FileLock(store_path + '.lock'):
+    if IsFresh(json_path, store_path):
+      return store_path
+    import duckdb
+    fd, temp_path = tempfile.mkstemp(
+      dir=os.path.dirname(store_path) or '.',
+      prefix=os.path.basename(store_path) + '.', suffix='.tmp')
+    os.close(fd)
+    Quote = lambda s: "'%s'" % s.replace("'", "''")
+    connection = duckdb.connect()
+    try:
+      connection.execute(
+        'COPY (SELECT * FROM read_json_auto(%s)) TO %s (FORMAT PARQUET)' % (
+          Quote(json_path), Quote(temp_path)))
+      os.replace(temp_path, store_path)
+    finally:
+      connection.close()
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+  return store_path
+
+
+def RewriteJsonSources(program, store_directory=None):
+  """Ingests JSON sources of the program and points the program at them."""
+  def Replace(match):
+    store_path = IngestJsonSource(match.group(1), store_directory)
+    return "`('%s')`" % store_path
+  return JSON_SOURCE_PATTERN.sub(Replace, program)
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory execution of simple reports with pandas.
+
+Fact tables are loaded into memory once and reports are computed with
+vectorized group-by, without compiling and running SQL. Only predicates of
+the following forms are understood:
+  Dimension(fact) = fact.field;
+  Dimension(fact) = "constant";
+  Measure(fact) = Sum(fact.field);  Measure(fact) = Sum(1);
+  Measure(fact) = Count(fact.field);  Measure(fact) = Count(1);
+  Filter(fact, parameter:) :- fact.field > parameter;  (or <, >=, <=, ==, !=)
+  Filter(fact, parameter:) :- Constraint(fact.field in parameter);
+Reports using anything else go through SQL.
+"""
+
+import operator
+import re
+import threading
+
+import execution
+import warming
+
+from logica.parser_py import parse
+
+
+FACTS_PREDICATE = 'LogicLMInMemoryFacts'
+
+COMPARISONS = {
+  '>': operator.gt, '<': operator.lt, '>=': operator.ge, '<=': operator.le,
+  '==': operator.eq, '!=': operator.ne
+}
+
+FIELD_DIMENSION = re.compile(r'(\w+)\(fact\) = fact\.(\w+)')
+CONSTANT_DIMENSION = re.compile(r'(\w+)\(fact\) = "([^"]*)"')
+MEASURE = re.compile(r'(\w+)\(fact\) = (Sum|Count)\((?:fact\.(\w+)|(1))\)')
+COMPARISON_FILTER = re.compile(
+  r'(\w+)\(fact, (\w+):\) :- fact\.(\w+) (>=|<=|==|!=|>|<) (\w+)')
+INCLUSION_FILTER = re.compile(
+  r'(\w+)\(fact, (\w+):\) :- Constraint\(fact\.(\w+) in (\w+)\)')
+
+
+class UnsupportedReport(Exception):
+  """Raised when report needs something in-memory engine can't do."""
+
+
+def PandasAvailable():
+  try:
+    import pandas
+  except ImportError:
+    return False
+  return True
+
+
+def Normalized(text):
+  return re.sub(r'\s+', ' ', text).strip()
+
+
+class InMemoryEngine:
+  """Computes reports over fact tables held in pandas data frames.
+
+  Data frame of a fact table is reloaded when data files are modified.
+  """
+  def __init__(self, config):
+    self.config = config
+    self.lock = threading.Lock()
+    self.tables = {}
+    # Locks of loading each table, so that reports over other tables, or
+    # over loaded ones, don't wait for a load.
+    self.loading_locks = {}
+    self.data_files = warming.DataFiles(config)
+    self.dimensions = {}
+    self.measures = {}
+    self.filters = {}
+    with open(config['logica_program']) as f:
+      rules = parse.ParseFile(f.read())['rule']
+    rules_of_predicate = {}
+    for r in rules:
+      rules_of_predicate.setdefault(r['head']['predicate_name'], []).append(
+        Normalized(r['full_text']))
+    for rule_texts in rules_of_predicate.values():
+      if len(rule_texts) == 1:
+        self.Understand(rule_texts[0])
+
+  def Understand(self, rule_text):
+    if m := FIELD_DIMENSION.fullmatch(rule_text):
+      self.dimensions[m.group(1)] = ('field', m.group(2))
+    elif m := CONSTANT_DIMENSION.fullmatch(rule_text):
+      self.dimensions[m.group(1)] = ('constant', m.group(2))
+    elif m := MEASURE.fullmatch(rule_text):
+      self.measures[m.group(1)] = (m.group(2), m.group(3))
+    elif m := COMPARISON_FILTER.fullmatch(rule_text):
+      if m.group(2) == m.group(5):
+        self.filters[m.group(1)] = (m.group(2), m.group(4), m.group(3))
+    elif m := INCLUSION_FILTER.fullmatch(rule_text):
+      if m.group(2) == m.group(4):
+        self.filters[m.group(1)] = (m.group(2), 'in', m.group(3))
+
+  def AdoptTables(self, engine, is_stale):
+    """Takes loaded tables of engine of previous version of the config."""
+    if engine.Fields() != self.Fields():
+      return
+    with engine.lock:
+      self.tables = {t: v for t, v in engine.tables.items()
+                     if not is_stale(t)}
+
+  def Fields(self):
+    """Fields of the facts that the understood predicates use."""
+    fields = set()
+    for kind, field in self.dimensions.values():
+      if kind == 'field':
+        fields.add(field)
+    fields |= {field for _, field in self.measures.values() if field}
+    fields |= {field for _, _, field in self.filters.values()}
+    return sorted(fields)
+
+  def LoadedTable(self, fact_table, data_version):
+    with self.lock:
+      if fact_table in self.tables:
+        version, table = self.tables[fact_table]
+        if version == data_version:
+          return table
+    return None
+
+  def Table(self, o, fact_table, cancellation=None):
+    """Data frame with the facts of the table, loaded if needed."""
+    data_version = warming.DataVersion(self.data_files)
+    table = self.LoadedTable(fact_table, data_version)
+    if table is not None:
+      return table
+    with self.lock:
+      loading_lock = self.loading_locks.setdefault(fact_table,
+                                                   threading.Lock())
+    with loading_lock:
+      table = self.LoadedTable(fact_table, data_version)
+      if table is not None:
+        return table
+      import pandas
+      fields = self.Fields()
+      rule = '%s(%s) :- %s(fact)' % (
+        FACTS_PREDICATE,
+        ', '.join('%s: fact.%s' % (f, f) for f in fields) or 'x: 1',
+        fact_table)
+      header, rows = execution.RunPredicate(
+        o.BaseProgram() + ';\n' + rule, FACTS_PREDICATE,
+        cancellation=cancellation)
+      table = pandas.DataFrame(execution.Rows(rows), columns=header)
+      table = table.convert_dtypes()
+      with self.lock:
+        self.tables[fact_table] = (data_version, table)
+      return table
+
+  def Call(self, o, call_str):
+    call = o.AsPredicateCall(call_str)
+    return call.predicate_name, {k: v.AsJson()
+                                 for k, v in call.named_args.items()}
+
+  def FactTable(self, o):
+    """Fact table of the report, raising UnsupportedReport if it can't run."""
+    if (o.preview or len(o.relevant_fact_tables) != 1 or
+        o.direct_dependency or len(o.MeasureTablePredicates()) != 1):
+      raise UnsupportedReport('Report is not over a single fact table.')
+    [fact_table] = o.relevant_fact_tables
+    for d in o.dimensions:
+      name, args = self.Call(o, d)
+      if name not in self.dimensions or args:
+        raise UnsupportedReport('Dimension %s is not understood.' % d)
+    for m in o.measures:
+      name, args = self.Call(o, m)
+      if name not in self.measures or args:
+        raise UnsupportedReport('Measure %s is not understood.' % m)
+    for f in o.filters:
+      name, args = self.Call(o, f)
+      if name not in self.filters or list(args) != [self.filters[name][0]]:
+        raise UnsupportedReport('Filter %s is not understood.' % f)
+    return fact_table
+
+  def Run(self, o, cancellation=None):
+    """Computes the report of the Olap, which program was already built.
+
+    Cancellation is checked between the steps, pandas can't be interrupted
+    within one. Raises UnsupportedReport if the report needs to go through
+    SQL.
+    """
+    if not PandasAvailable():
+      raise UnsupportedReport('Pandas is not installed.')
+    import pandas
+    cancellation = cancellation or execution.Cancellation()
+    fact_table = self.FactTable(o)
+    table = self.Table(o, fact_table, cancellation)
+    for f in o.filters:
+      cancellation.CheckNotCancelled()
+      name, args = self.Call(o, f)
+      parameter, comparison, field = self.filters[name]
+      value = args[parameter]
+      if comparison == 'in':
+        table = table[table[field].isin(value).fillna(False)]
+      else:
+        table = table[COMPARISONS[comparison](table[field], value).fillna(
+          False)]
+    keys = {}
+    for d in o.dimensions:
+      kind, value = self.dimensions[self.Call(o, d)[0]]
+      keys[o.ColumnName(d)] = (table[value] if kind == 'field' else
+                               pandas.Series(value, index=table.index))
+    grouped = pandas.DataFrame(keys).groupby(list(keys), dropna=False,
+                                             sort=False)
+    columns = {}
+    for m in o.measures:
+      cancellation.CheckNotCancelled()
+      aggregation, field = self.measures[self.Call(o, m)[0]]
+      if field is None and aggregation == 'Count':
+        # Count is a distinct count, there is a single value in each group.
+        columns[o.ColumnName(m)] = grouped.size().clip(upper=1)
+      elif field is None:
+        columns[o.ColumnName(m)] = grouped.size()
+      elif aggregation == 'Sum':
+        columns[o.ColumnName(m)] = table[field].groupby(
+          [keys[k] for k in keys], dropna=False, sort=False).sum(min_count=1)
+      else:
+        columns[o.ColumnName(m)] = table[field].groupby(
+          [keys[k] for k in keys], dropna=False, sort=False).nunique()
+    cancellation.CheckNotCancelled()
+    result = pandas.DataFrame(columns).reset_index()
+    result.columns = list(keys) + list(columns)
+    header = list(result.columns)
+    values = [[None if pandas.isna(v) else v
+               for v in result[c].astype(object).tolist()]
+              for c in header]
+    rows = list(zip(*values))
+    [predicate] = o.MeasureTablePredicates()
+    return o.AssembleReport({predicate: (header, rows)})
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of inmemory, comparing its reports to ones of SQL."""
+
+import json
+import unittest
+
+import ai
+import execution
+import inmemory
+import olap
+import server
+
+
+CONFIG_PATH = 'test_data/sales/sales.json'
+
+
+def Request(measures, dimensions, filters=()):
+  return {'measures': list(measures), 'dimensions': list(dimensions),
+          'filters': list(filters), 'order': [], 'limit': -1,
+          'chartType': 'Table()'}
+
+
+class InMemoryEngineTest(unittest.TestCase):
+
+  def setUp(self):
+    with open(CONFIG_PATH) as f:
+      self.config = json.load(f)
+    self.engine = inmemory.InMemoryEngine(self.config)
+
+  def Olap(self, request):
+    o = olap.Olap(self.config, request)
+    o.GetLogicProgram()
+    return o
+
+  def SqlReport(self, o):
+    header, rows = execution.RunPredicate(o.GetFullLogicProgram(), 'Report')
+    return header, sorted(map(list, execution.Rows(rows)))
+
+  def InMemoryReport(self, o):
+    header, rows = self.engine.Run(o)
+    return header, sorted(map(list, rows))
+
+  def assertSameAsSql(self, request):
+    o = self.Olap(request)
+    self.assertEqual(self.InMemoryReport(o), self.SqlReport(o))
+
+  def testMeasures(self):
+    self.assertSameAsSql(Request(
+      ['Revenue()', 'NumSales()', 'HasSales()', 'Customers()'], ['Region()']))
+
+  def testCountOfConstantIsDistinct(self):
+    o = self.Olap(Request(['HasSales()'], ['Region()']))
+    header, rows = self.InMemoryReport(o)
+    self.assertEqual([r[1] for r in rows], [1, 1, 1, 1])
+
+  def testDimensions(self):
+    self.assertSameAsSql(Request(['Revenue()'], ['Region()', 'Product()']))
+    self.assertSameAsSql(Request(['Revenue()', 'Customers()'], ['Total()']))
+
+  def testFilters(self):
+    self.assertSameAsSql(Request(
+      ['Revenue()', 'NumSales()'], ['Product()'],
+      ['MinAmount(amount: 30)',
+       'RegionIn(regions: ["east", "north", "south"])']))
+
+  def testFilterLeavingNoFacts(self):
+    self.assertSameAsSql(Request(['Revenue()'], ['Region()'],
+                                 ['MinAmount(amount: 100)']))
+
+  def testUnsupportedPredicates(self):
+    for request in [Request(['AverageAmount()'], ['Region()']),
+                    Request(['Revenue()'], ['UpperRegion()']),
+                    Request(['Revenue()', 'TargetRevenue()'], ['Region()'])]:
+      with self.assertRaises(inmemory.UnsupportedReport):
+        self.engine.Run(self.Olap(request))
+
+  def testServerFallsBackToSql(self):
+    heart = server.LogicLMServerHeart(
+      dict(self.config, in_memory_engine=True, log_level='warning'),
+      ai.RecordedAI.FromTranslations({}))
+    for request in [Request(['Revenue()', 'Customers()'], ['Region()']),
+                    Request(['AverageAmount()'], ['UpperRegion()'])]:
+      o = self.Olap(request)
+      unused_program, unused_sql, data = heart.RunJson(dict(request))
+      self.assertEqual((data[0], sorted(map(list, data[1:]))),
+                       self.SqlReport(o))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -15,14 +15,19 @@
 # limitations under the License.
 
 
+import os
 import sys
 import json
 
 import olap
 import ai
+import execution
+import matcher
+import profiling
 import server
 
 from logica.common import logica_lib
+from logica.common import sqlite3_logica
 from logica.type_inference.research import infer
 from logica.parser_py import parse
 
@@ -78,18 +83,65 @@ def JsonConfigFromLogicLMPredicate(config_filename):
   return config
 
 
+def LoadConfig(config_filename):
+  if config_filename[-4:] == 'json':
+    with open(config_filename) as f:
+      return json.loads(f.read())
+  return JsonConfigFromLogicLMPredicate(config_filename)
+
+
+def HostedConfigs(config_filenames, configs):
+  """Configs by path and by file name without extension."""
+  hosted_configs = {}
+  for config_filename, config in zip(config_filenames, configs):
+    name = os.path.splitext(os.path.basename(config_filename))[0]
+    hosted_configs[config_filename] = config
+    hosted_configs.setdefault(name, config)
+  return hosted_configs
+
+
+def ProfileRequest(config, request, execute=False, deterministic=False):
+  """Profiles building the report of the request, and running it."""
+  profile = profiling.Profile(deterministic=deterministic)
+  with profile.Stage('olap'):
+    analyzer = olap.Olap(config, request)
+  with profile.Stage('logic_program'):
+    analyzer.GetLogicProgram()
+  with profile.Stage('sql'):
+    analyzer.GetSQL()
+  if execute:
+    logic_program = str(analyzer.GetFullLogicProgram())
+    with profile.Stage('execution'):
+      execution.RunPredicate(logic_program, 'Report')
+  return profile
+
+
+def RunRequest(config, request):
+  """Runs the request as server does, printing the report."""
+  config.setdefault('log_level', 'warning')
+  heart = server.LogicLMServerHeart(config,
+                                    ai.RecordedAI.FromTranslations({}))
+  unused_logic_program, unused_sql, data = heart.RunJson(request)
+  if request.get('nice_error'):
+    print(request['nice_error'])
+    return
+  print(sqlite3_logica.ArtisticTable(data[0], data[1:]))
+  if request.get('approximate'):
+    print('Report is approximate.')
+
+
 def main(argv):
   config_filename = argv[1]
   command = argv[2]
-  if config_filename[-4:] == 'json':
-    with open(config_filename) as f:
-      config = json.loads(f.read())
-  else:
-    config = JsonConfigFromLogicLMPredicate(config_filename)
+  config = LoadConfig(config_filename)
 
   if command == 'understand':
     user_request = argv[3]
     print(Understand(config, user_request))
+  elif command == 'understand_offline':
+    user_request = argv[3]
+    print(json.dumps(matcher.Matcher(config).Understand(user_request),
+                     indent=2))
   elif command == 'logic_program':
     request = json.loads(argv[3])
     analyzer = olap.Olap(config, request)
@@ -98,8 +150,38 @@ def main(argv):
     request = json.loads(argv[3])
     analyzer = olap.Olap(config, request)
     print(analyzer.GetSQL())
+  elif command == 'profile':
+    # Flags: --execute, --deterministic, --output=<file>.
+    request = json.loads(argv[3])
+    flags = argv[4:]
+    deterministic = '--deterministic' in flags
+    output = 'logiclm_profile.%s' % ('prof' if deterministic else 'folded')
+    for flag in flags:
+      if flag.startswith('--output='):
+        output = flag[len('--output='):]
+    profile = ProfileRequest(config, request, '--execute' in flags,
+                             deterministic)
+    profile.Write(output)
+    print(json.dumps(profile.Summary(), indent=2))
+    print('Profile is written to %s.' % output)
+  elif command == 'run':
+    # Flags: --set=<field>=<json>, overriding field of the config.
+    request = json.loads(argv[3])
+    for flag in argv[4:]:
+      if flag.startswith('--set='):
+        field, value = flag[len('--set='):].split('=', 1)
+        config[field] = json.loads(value)
+    RunRequest(config, request)
   elif command == 'show_prompt':
     print(ai.GetPromptTemplate(config))
+  elif command == 'show_compact_prompt':
+    user_request = argv[3]
+    template, statistics = ai.GetCompactPromptTemplate(
+      config, user_request,
+      top_k=config.get('prompt_top_k', 5),
+      min_confidence=config.get('prompt_min_confidence', 0.75))
+    print(template)
+    print('Prompt size:', json.dumps(statistics, sort_keys=True))
   elif command == 'understand_and_program':
     user_request = argv[3]
     request = Understand(config, user_request)
@@ -115,7 +197,12 @@ def main(argv):
       parsing_exception.ShowMessage()
       sys.exit(1)
   elif command == 'start_server':
-    server.StartServer(config)
+    # Further configs can be listed to serve them from the same process.
+    config_filenames = [config_filename] + argv[3:]
+    configs = [config] + [LoadConfig(f) for f in argv[3:]]
+    server.StartServer(config, HostedConfigs(config_filenames, configs),
+                       config_files=list(zip(config_filenames, configs)),
+                       load_config=LoadConfig)
   elif command == 'remove_dashboard_from_config':
     config['dashboard'] = {}
     print(json.dumps(config, indent='  '))
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asynchronous structured logging of the server.
+
+Records are put on a bounded queue as they are, and are formatted and
+written by a background thread, so request threads never wait for the
+terminal or the log file. When the queue is full records are dropped.
+
+Each config logs to its own logger with level of its log_level field.
+Format and destination are taken from the config that starts the logging:
+  log_format: 'text' (default) or 'json', one object per line.
+  log_file: File to append to, instead of standard output.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import threading
+import time
+
+
+QUEUE_SIZE = 10000
+
+lock = threading.Lock()
+listener = None
+
+
+class Lazy:
+  """Value computed when the record is formatted, e.g. a table of rows."""
+  def __init__(self, compute):
+    self.compute = compute
+
+  def __str__(self):
+    return str(self.compute())
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+  """Queues records without formatting them, dropping them when full."""
+  def __init__(self, record_queue):
+    super().__init__(record_queue)
+    self.dropped = 0
+
+  def prepare(self, record):
+    return record
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+  """Formats message and the fields passed in extra={'fields': {...}}."""
+  def __init__(self, as_json=False):
+    super().__init__()
+    self.as_json = as_json
+
+  def format(self, record):
+    fields = {k: str(v) if isinstance(v, Lazy) else v
+              for k, v in getattr(record, 'fields', {}).items()}
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(record.created))
+    if self.as_json:
+      entry = {'time': record.created, 'level': record.levelname,
+               'logger': record.name, 'message': record.getMessage()}
+      entry.update(fields)
+      if record.exc_info:
+        entry['exception'] = self.formatException(record.exc_info)
+      return json.dumps(entry, default=str)
+    lines = ['%s %s %s: %s' % (timestamp, record.levelname, record.name,
+                               record.getMessage())]
+    for k, v in fields.items():
+      v = v if isinstance(v, str) else json.dumps(v, default=str)
+      if '\n' in v:
+        lines.append('  %s:\n%s' % (k, v))
+      else:
+        lines.append('  %s: %s' % (k, v))
+    if record.exc_info:
+      lines.append(self.formatException(record.exc_info))
+    return '\n'.join(lines)
+
+
+def Start(config):
+  """Starts writing the records of the server, once per process."""
+  global listener
+  with lock:
+    if listener:
+      return
+    if config.get('log_file'):
+      handler = logging.FileHandler(config['log_file'])
+    else:
+      handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(
+      StructuredFormatter(as_json=config.get('log_format') == 'json'))
+    record_queue = queue.Queue(QUEUE_SIZE)
+    root = logging.getLogger('logiclm')
+    root.addHandler(DroppingQueueHandler(record_queue))
+    root.propagate = False
+    listener = logging.handlers.QueueListener(record_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+# Names of the loggers taken by configs, so that configs sharing a name get
+# loggers of their own.
+config_logger_names = set()
+
+
+def ConfigLoggerName(config):
+  """Name of logger for the config, which no other config uses."""
+  name = re.sub(r'\W+', '_', config.get('name', 'config')).strip('_')
+  base_name = 'logiclm.' + (name or 'config')
+  with lock:
+    logger_name, i = base_name, 1
+    while logger_name in config_logger_names:
+      i += 1
+      logger_name = '%s_%d' % (base_name, i)
+    config_logger_names.add(logger_name)
+  return logger_name
+
+
+def ConfigLogger(config, logger_name=None):
+  """Logger of the config, with the level the config asks for.
+
+  Reloaded config passes name of the logger it had, to keep it.
+  """
+  logger = logging.getLogger(logger_name or ConfigLoggerName(config))
+  logger.setLevel(str(config.get('log_level', 'INFO')).upper())
+  return logger
+
+
+def SampledRows(rows, max_rows):
+  """At most max_rows rows, evenly spread over the result."""
+  if len(rows) <= max_rows:
+    return list(rows)
+  if max_rows <= 0:
+    return []
+  step = len(rows) / max_rows
+  return [rows[int(i * step)] for i in range(max_rows)]
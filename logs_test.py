@@ -0,0 +1,51 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of logs."""
+
+import logging
+import unittest
+
+import logs
+
+
+class ConfigLoggerTest(unittest.TestCase):
+
+  def testConfigsSharingNameHaveOwnLevels(self):
+    debug = logs.ConfigLogger({'name': 'Shared name', 'log_level': 'debug'})
+    warning = logs.ConfigLogger({'name': 'Shared name',
+                                 'log_level': 'warning'})
+    self.assertNotEqual(debug.name, warning.name)
+    self.assertEqual(debug.level, logging.DEBUG)
+    self.assertEqual(warning.level, logging.WARNING)
+
+  def testConfigsWithoutName(self):
+    first = logs.ConfigLogger({})
+    second = logs.ConfigLogger({'log_level': 'error'})
+    self.assertNotEqual(first.name, second.name)
+    self.assertEqual(first.level, logging.INFO)
+
+  def testReloadedConfigKeepsLogger(self):
+    logger = logs.ConfigLogger({'name': 'Reloaded'})
+    reloaded = logs.ConfigLogger({'name': 'Reloaded', 'log_level': 'error'},
+                                 logger.name)
+    self.assertIs(reloaded, logger)
+    self.assertEqual(logger.level, logging.ERROR)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rule based understanding of simple requests, without calling the LLM.
+
+Recognized requests are
+  <measures> by <dimensions>, e.g. "impressions and reach by device",
+  top <N> <dimensions> by <measure>, e.g. "top 3 campaigns by impressions".
+Measures and dimensions are referred to by the words of the names of their
+predicates, e.g. "number of babies" for NumberOfBabies. Predicates with
+parameters are not recognized, as their arguments would have to be
+understood. Matcher gives up if any word of the request is not understood,
+so that such requests go to the LLM.
+"""
+
+import re
+
+import retrieval
+
+
+LEADING_WORDS = set("""
+please show me give list what are is the display plot chart
+""".split())
+
+PHRASE_FILLER_WORDS = set("""
+the total all
+""".split())
+
+
+def PhraseKey(words):
+  return tuple(w for w in words if w not in PHRASE_FILLER_WORDS)
+
+
+class Matcher:
+  def __init__(self, config):
+    self.measures = self.PhraseIndex(config['measures'],
+                                     'aggregating_function')
+    self.dimensions = self.PhraseIndex(config['dimensions'], 'function')
+    self.chart_types = set(c['predicate']['predicate_name']
+                           for c in config['chart_types'])
+
+  def PhraseIndex(self, entries, call_field):
+    """Predicate names by words of their names."""
+    result = {}
+    for e in entries:
+      call = e[call_field]
+      if call.get('parameters'):
+        continue
+      name = call['predicate_name']
+      result.setdefault(PhraseKey(retrieval.Words(name)), name)
+    return result
+
+  def Resolve(self, words, index):
+    """Predicate calls of the phrases separated by 'and', or None.
+
+    Names may contain 'and' themselves, e.g. DeviceAndCrossDevice, so each
+    way of splitting the words is tried.
+    """
+    if not words:
+      return None
+    name = index.get(PhraseKey(words))
+    if name:
+      return [name + '()']
+    for i, w in enumerate(words):
+      if w != 'and':
+        continue
+      left = self.Resolve(words[:i], index)
+      right = left and self.Resolve(words[i + 1:], index)
+      if right:
+        return left + right
+    return None
+
+  def ChartType(self, dimensions):
+    if dimensions == ['Total()']:
+      chart_type = 'TotalsCard'
+    elif len(dimensions) == 1:
+      chart_type = 'BarChart'
+    else:
+      chart_type = 'Table'
+    if chart_type not in self.chart_types:
+      chart_type = 'Table'
+    return chart_type + '()'
+
+  def Understand(self, user_request):
+    """Returns JSON request or None if request is not recognized."""
+    words = retrieval.Words(user_request.replace(',', ' and '))
+    while words and words[0] in LEADING_WORDS:
+      words = words[1:]
+    if words.count('by') != 1:
+      return None
+    by = words.index('by')
+    left, right = words[:by], words[by + 1:]
+    title = re.sub(r'\s+', ' ', user_request.strip(' ?.!"'))
+    title = title[:1].upper() + title[1:]
+    if len(left) > 2 and left[0] == 'top' and left[1].isdigit():
+      dimensions = self.Resolve(left[2:], self.dimensions)
+      measures = self.Resolve(right, self.measures)
+      if not dimensions or not measures or len(measures) != 1:
+        return None
+      order = [measures[0] + ' desc']
+      limit = int(left[1])
+    else:
+      measures = self.Resolve(left, self.measures)
+      dimensions = self.Resolve(right, self.dimensions)
+      if not dimensions or not measures:
+        return None
+      order = []
+      limit = -1
+    return {
+      'title': title,
+      'measures': measures,
+      'dimensions': dimensions,
+      'filters': [],
+      'order': order,
+      'limit': limit,
+      'chartType': self.ChartType(dimensions)
+    }
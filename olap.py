@@ -15,7 +15,9 @@
 # limitations under the License.
 
 
+import functools
 import hashlib
+import ingest
 import jsonschema
 import json
 import schema
@@ -27,6 +29,57 @@ from logica.tools import avatar
 from logica.parser_py import parse
 
 
+# Predicate call strings repeat within and across requests, so their parsed
+# syntax, terms and column names are interned for the whole process.
+INTERN_TABLE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=INTERN_TABLE_SIZE)
+def ParsedExpression(s):
+  """Syntax of the expression, shared by callers, must not be modified."""
+  return parse.ParseExpression(parse.HeritageAwareString(s))
+
+
+@functools.lru_cache(maxsize=INTERN_TABLE_SIZE)
+def CalledPredicate(predicate_call):
+  parsed_call = ParsedExpression(predicate_call)
+  assert 'call' in parsed_call, parsed_call
+  return parsed_call['call']['predicate_name']
+
+
+@functools.lru_cache(maxsize=INTERN_TABLE_SIZE)
+def InternedTerm(predicate_call):
+  return avatar.LogicalTerm.FromSyntax(ParsedExpression(predicate_call))
+
+
+@functools.lru_cache(maxsize=INTERN_TABLE_SIZE)
+def ColumnName(predicate_call):
+  disambiguation = abs(Hash(predicate_call)) % 1000000
+  return '_'.join([CalledPredicate(predicate_call).lower(),
+                   str(disambiguation)])
+
+
+# Digests of configs that passed validation. Validating takes longer than
+# building a report, and config is the same for all reports of the server.
+validated_configs = set()
+
+
+def ValidateConfig(config):
+  digest = hashlib.md5(
+    json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+  if digest in validated_configs:
+    return
+  jsonschema.validate(config, schema.OlapConfig())
+  validated_configs.add(digest)
+
+
+def InternStatistics():
+  """Hits and misses of the intern tables, by table."""
+  return {f.__name__: f.cache_info()._asdict()
+          for f in [ParsedExpression, CalledPredicate, InternedTerm,
+                    ColumnName]}
+
+
 def GetPredicateCallsField(request, field_name):
   predicate_calls = request.get(field_name, [])
   return [c.replace("'", '"')
@@ -35,10 +88,9 @@ def GetPredicateCallsField(request, field_name):
 
 class Olap:
   def __init__(self, config, request):
-    jsonschema.validate(config, schema.OlapConfig())
+    ValidateConfig(config)
     self.config = config
     self.request = request
-    self.called_predicate_cache = {}
     self.measures = GetPredicateCallsField(request, 'measures')
     default_fact_table = config['default_fact_table']
     self.fact_table_of_measure = {
@@ -66,6 +118,14 @@ class Olap:
     self.table_to_ephemeral_dimensions = self.BuildEphemeralDimensions()
     self.filter_to_needed_dimensions = self.BuildFilterToNeededDimensions()
     self.dialect = config.get('dialect', 'psql')
+    self.preview = bool(request.get('preview'))
+    self.preview_of_table = {
+      t['fact_table']: t['preview']
+      for t in self.config['fact_tables'] if 'preview' in t}
+    self.measures_scaled_in_preview = {
+      m['aggregating_function']['predicate_name']
+      for m in self.config['measures'] if m.get('scale_in_preview')}
+    self.sampled_tables = []
 
   def QuotedField(self, field):
     if self.dialect == 'duckdb':
@@ -73,6 +133,12 @@ class Olap:
     return "`%s`" % field
 
   def DimensionsDomainRule(self) -> avatar.Rule:
+    """Rule of the dimension values of facts passing the filters.
+
+    Domain is a WITH table, computed once per query. It is not kept across
+    requests, rows of it would have to be embedded in compiled programs,
+    which are cached per config version, not per version of the data.
+    """
     dimensions_domain_predicate = avatar.Predicate('DimensionsDomain')
     fact_variable = avatar.Variable('fact')
     dimensions_args = {
@@ -193,9 +259,7 @@ class Olap:
     return str(rule)
 
   def ColumnName(self, predicate_call):
-    p = self.CalledPredicate(predicate_call)
-    disambiguation = abs(Hash(predicate_call)) % 1000000
-    return '_'.join([p.lower(), str(disambiguation)])
+    return ColumnName(predicate_call)
 
   def UnionFacts(self, unioned_table, component_fact_tables):
     unioned_predicate = avatar.Predicate(unioned_table)
@@ -271,25 +335,74 @@ class Olap:
     return consolidating_predicate_name, rule
 
   def ParseExpression(self, s):
-    return parse.ParseExpression(parse.HeritageAwareString(s))
+    return ParsedExpression(s)
 
   def CalledPredicate(self, predicate_call):
-    if predicate_call not in self.called_predicate_cache:
-      parsed_call = self.ParseExpression(predicate_call)
-      assert 'call' in parsed_call, parsed_call
-      self.called_predicate_cache[predicate_call] = parsed_call['call']['predicate_name']
-    return self.called_predicate_cache[predicate_call]
+    return CalledPredicate(predicate_call)
 
   def AsPredicateCall(self, predicate_call_str):
-    parsed_call = self.ParseExpression(predicate_call_str)
-    call = avatar.LogicalTerm.FromSyntax(parsed_call)
-    return call
+    term = InternedTerm(predicate_call_str)
+    if not isinstance(term, avatar.PredicateCall):
+      return term
+    # Calling a term modifies its positional arguments, so each caller gets
+    # its own copy of the interned one.
+    return avatar.PredicateCall(term.predicate_name, term.positional_args,
+                                term.named_args, term.distinct_denoted)
 
   def FactTableDimensions(self, t):
     return [
       d for d in self.dimensions
       if self.CalledPredicate(d) not in self.table_to_ephemeral_dimensions[t]]
   
+  def TopNPushdownRule(self, rules_for_measures):
+    """Returns consolidating rule that top-N can be computed in, if any.
+
+    Pushdown applies when ordering is fully determined by columns of a single
+    consolidating rule and the leading order key is a measure of that rule.
+    Other measures are then joined only for the surviving keys.
+    """
+    if self.limit < 0 or not self.order:
+      return None
+    if len(self.measures_to_compute_from_table) < 2:
+      return None
+    order_calls = [call for call, _ in map(SplitOrder, self.order)]
+    if order_calls[0] not in self.table_needed_by_measure:
+      return None
+    fact_table = self.table_needed_by_measure[order_calls[0]]
+    for call in order_calls:
+      if call in self.table_needed_by_measure:
+        if self.table_needed_by_measure[call] != fact_table:
+          return None
+      elif call in self.dimensions:
+        if (self.CalledPredicate(call) in
+            self.table_to_ephemeral_dimensions[fact_table]):
+          return None
+      else:
+        return None
+    fact_tables = list(self.measures_to_compute_from_table)
+    return rules_for_measures[fact_tables.index(fact_table)]
+
+  def TopNRule(self, top_n_rule, rules_for_measures):
+    """Rule of the keys of top-N rule that every measure table has.
+
+    Report is an inner join, so top-N is taken among these keys only,
+    otherwise keys dropped by the join would leave the report short.
+    """
+    columns = list(top_n_rule.head.named_args)
+    head = avatar.Predicate('TopN' + top_n_rule.head.predicate_name)(
+      **{c: avatar.Variable(c) for c in columns})
+    body = avatar.Predicate(top_n_rule.head.predicate_name)(
+      **{c: avatar.Variable(c) for c in columns})
+    dimension_columns = [self.ColumnName(d) for d in self.dimensions]
+    for rule in rules_for_measures:
+      if rule is top_n_rule:
+        continue
+      keys = [c for c in rule.head.named_args
+              if c in dimension_columns and c in columns]
+      body = body & avatar.Predicate(rule.head.predicate_name)(
+        **{c: avatar.Variable(c) for c in keys})
+    return +head << body
+
   def GetLogicProgram(self):
     self.source_of_measure = {}
     needs_building = []
@@ -312,6 +425,9 @@ class Olap:
         filters = []
       else:
         translucent_dimensions = []
+        if self.preview and fact_table in self.preview_of_table:
+          filters = filters + [self.preview_of_table[fact_table]['sample']]
+          self.sampled_tables.append(fact_table)
 
       consolidated_table, rule = self.ConsolidateFacts(
         fact_table, measures, dimensions, filters, {}, {}, translucent_dimensions)
@@ -357,45 +473,133 @@ class Olap:
         program.AddRule(self.UnionFacts(fact_table_to_build, ts))
       i += 1
     if need_dimensions_domain:
-      program.AddRule(dimensions_domain_rule
-                      )
+      # Domain is joined with every consolidated table, forcing it into a
+      # WITH table makes engine compute it once.
+      program.AddRule(avatar.Predicate('@With')(
+        avatar.Literal(dimensions_domain_rule.head.predicate_name)) << None)
+      program.AddRule(dimensions_domain_rule)
     def ColumnName(predicate_call_str):
-      return self.QuotedField(
-        predicate_call_str.replace('(', '<').replace(')', '>').replace('"', "'").replace('"', "'"))
+      return self.QuotedField(ReportColumnName(predicate_call_str))
     # Assembling all the measures together.
-    measures_args = {ColumnName(m): avatar.Variable(self.ColumnName(m))
+    measures_args = {ColumnName(m): self.ScaledForPreview(
+                       m, avatar.Variable(self.ColumnName(m)))
                      for m in self.measures}
     dimensions_args = {ColumnName(d): avatar.Variable(self.ColumnName(d))
                        for d in self.dimensions}
+    report_rules = rules_for_measures
+    top_n_rule = self.TopNPushdownRule(rules_for_measures)
+    if top_n_rule:
+      # Other measure tables are read by both top-N and Report rules, so
+      # they are forced into WITH tables to compute them once.
+      for rule in rules_for_measures:
+        if rule is not top_n_rule:
+          program.AddRule(avatar.Predicate('@With')(
+            avatar.Literal(rule.head.predicate_name)) << None)
+      limited_rule = self.TopNRule(top_n_rule, rules_for_measures)
+      report_rules = [limited_rule if r is top_n_rule else r
+                      for r in rules_for_measures]
+      p = limited_rule.head.predicate_name
+      order_rule = avatar.Predicate('@OrderBy')(
+        avatar.Literal(p),
+        *[avatar.Literal(self.ColumnName(c) + ' ' + d)
+          for c, d in map(SplitOrder, self.order)]) << None
+      order_rule.comment_before_rule = 'Pushing top-N down to %s.' % p
+      program.AddRule(order_rule)
+      program.AddRule(avatar.Predicate('@Limit')(
+        avatar.Literal(p), avatar.Literal(self.limit)) << None)
+      program.AddRule(limited_rule)
     if self.limit >= 0:
       program.AddRule(avatar.Predicate('@Limit')(
         avatar.Literal('Report'), avatar.Literal(self.limit)) << None)
     if self.order:
       def DecorateOrder(s):
-        for suffix in ['asc', 'desc']:
-          if s.endswith(suffix):
-            direction = suffix
-            s = s.removesuffix(' ' + suffix)
-            break
-        else:
-          direction = 'asc'
-        return ColumnName(s) + ' ' + direction
+        call, direction = SplitOrder(s)
+        return ColumnName(call) + ' ' + direction
       program.AddRule(avatar.Predicate('@OrderBy')(
         avatar.Literal('Report'), *map(lambda x: avatar.Literal(DecorateOrder(x)),
                                        self.order)) << None)
     head = avatar.Predicate('Report')(**(dimensions_args | measures_args))
     body = avatar.Conjunction([])
-    for rule in rules_for_measures:
+    for rule in report_rules:
       p = rule.head.predicate_name
       named_args = {a: avatar.Variable(a) for a in rule.head.named_args}
       body = body & avatar.Predicate(p)(**named_args)
     rule = head << body
     rule.comment_before_rule = 'Assembling all the measures.'
     program.AddRule(rule)
+    self.rules_for_measures = rules_for_measures
     return program
 
+  def PreviewSamplingFactor(self, measure):
+    """Factor to scale measure by in preview, or None if it is not scaled."""
+    table = self.table_needed_by_measure[measure]
+    if (table in self.sampled_tables and
+        self.CalledPredicate(measure) in self.measures_scaled_in_preview):
+      return self.preview_of_table[table]['sampling_factor']
+    return None
+
+  def ScaledForPreview(self, measure, value):
+    factor = self.PreviewSamplingFactor(measure)
+    if factor is None:
+      return value
+    return Product(value, avatar.Literal(factor))
+
+  def IsApproximate(self):
+    """Whether report is computed over a sample of the facts."""
+    return bool(self.sampled_tables)
+
+  def MeasureTablePredicates(self):
+    """Predicates computing measures, one per fact table."""
+    return [r.head.predicate_name for r in self.rules_for_measures]
+
+  def AssembleReport(self, parts):
+    """Joins results of measure table predicates into Report.
+
+    Args:
+      parts: Dictionary mapping predicate from MeasureTablePredicates to
+        (header, rows) of its result.
+
+    Returns:
+      Header and rows of the report, as Report predicate would produce them.
+    """
+    records = None
+    for p in self.MeasureTablePredicates():
+      header, rows = parts[p]
+      part_records = [dict(zip(header, row)) for row in rows]
+      if records is None:
+        records = part_records
+        continue
+      common = [c for c in header if c in records[0]] if records else []
+      index = {}
+      for r in part_records:
+        index.setdefault(tuple(r[c] for c in common), []).append(r)
+      records = [r | m
+                 for r in records
+                 for m in index.get(tuple(r[c] for c in common), [])]
+    # Sorting by the least significant key first, relying on stability.
+    for call, direction in reversed(list(map(SplitOrder, self.order))):
+      column = self.ColumnName(call)
+      records.sort(key=lambda r: (r[column] is not None, r[column]),
+                   reverse=(direction == 'desc'))
+    for m in self.measures:
+      factor = self.PreviewSamplingFactor(m)
+      if factor is not None:
+        column = self.ColumnName(m)
+        for r in records:
+          if r[column] is not None:
+            r[column] *= factor
+    if self.limit >= 0:
+      records = records[:self.limit]
+    calls = self.dimensions + self.measures
+    header = list(map(ReportColumnName, calls))
+    rows = [[r[self.ColumnName(c)] for c in calls] for r in records]
+    return header, rows
+
+  def BaseProgram(self):
+    return BaseProgram(self.config)
+
   def GetFullLogicProgram(self):
-    base_program = open(self.config['logica_program']).read()
+    base_program = self.BaseProgram()
     incremental_program = self.GetLogicProgram()
     program = base_program + ';\n' + str(incremental_program)
     return program
@@ -407,6 +611,37 @@ class Olap:
     sql = logic_program.FormattedPredicateSql('Report')
     return sql
 
+def BaseProgram(config):
+  """Logica program of the config, with JSON sources ingested if asked."""
+  with open(config['logica_program']) as f:
+    base_program = f.read()
+  if config.get('ingest_json_sources'):
+    base_program = ingest.RewriteJsonSources(
+      base_program, config.get('ingestion_directory'))
+  return base_program
+
+
+class Product(avatar.LogicalTerm):
+  def __init__(self, left, right):
+    self.left = left
+    self.right = right
+
+  def __str__(self):
+    return '%s * %s' % (self.left, self.right)
+
+
+def ReportColumnName(predicate_call_str):
+  return predicate_call_str.replace('(', '<').replace(')', '>').replace('"', "'")
+
+
+def SplitOrder(s):
+  """Splits order clause into predicate call and direction."""
+  for suffix in ['asc', 'desc']:
+    if s.endswith(suffix):
+      return s.removesuffix(' ' + suffix), suffix
+  return s, 'asc'
+
+
 def Hash(s):
   return abs(int(hashlib.md5(str(s).encode()).hexdigest()[:16], 16) - (1 << 63))
 
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profiling of building and running reports.
+
+Sampling profiler records stacks of the profiled thread, which are written
+in folded format, one 'frame;frame;frame count' line per stack, as read by
+flamegraph.pl, speedscope and inferno. Deterministic profiler uses cProfile
+and writes pstats file, as read by snakeviz or flameprof.
+"""
+
+import collections
+import contextlib
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+def FrameName(frame):
+  code = frame.f_code
+  module = frame.f_globals.get('__name__', code.co_filename)
+  return '%s:%s' % (module, getattr(code, 'co_qualname', code.co_name))
+
+
+def Stage(profile, name):
+  """Stage of the profile, or no-op context if profile is None."""
+  return profile.Stage(name) if profile else contextlib.nullcontext()
+
+
+class StageTimer:
+  """Records seconds of stages, without profiling them."""
+  traces_functions = False
+
+  def __init__(self):
+    self.stage_seconds = {}
+
+  @contextlib.contextmanager
+  def Stage(self, name):
+    started_at = time.time()
+    try:
+      yield
+    finally:
+      self.stage_seconds[name] = (self.stage_seconds.get(name, 0) +
+                                  time.time() - started_at)
+
+
+class Profile:
+  """Profile of stages of a piece of work running in the current thread.
+
+  Stacks are sampled at most once per switch interval of the interpreter,
+  5ms by default, as sampling thread needs the GIL.
+
+  Args:
+    deterministic: Whether to use cProfile instead of sampling stacks.
+    sample_interval_seconds: Period of sampling the stack.
+  """
+  traces_functions = True
+
+  def __init__(self, deterministic=False, sample_interval_seconds=0.001):
+    self.deterministic = deterministic
+    self.sample_interval_seconds = sample_interval_seconds
+    self.profile = cProfile.Profile() if deterministic else None
+    self.samples = collections.Counter()
+    self.sampled_seconds = 0.0
+    self.stage_seconds = {}
+
+  @contextlib.contextmanager
+  def Stage(self, name):
+    """Profiles the stage, its stacks are rooted at its name."""
+    started_at = time.time()
+    if self.deterministic:
+      self.profile.enable()
+      try:
+        yield
+      finally:
+        self.profile.disable()
+    else:
+      done = threading.Event()
+      # Frame with the stage, the frames calling it are not recorded.
+      caller = sys._getframe().f_back.f_back
+      sampler = threading.Thread(
+        target=self.Sample,
+        args=(name, threading.get_ident(), caller, done), daemon=True)
+      sampler.start()
+      try:
+        yield
+      finally:
+        done.set()
+        sampler.join()
+        self.sampled_seconds += time.time() - started_at
+    self.stage_seconds[name] = (self.stage_seconds.get(name, 0) +
+                                time.time() - started_at)
+
+  def Sample(self, stage, thread_id, caller, done):
+    while not done.wait(self.sample_interval_seconds):
+      frame = sys._current_frames().get(thread_id)
+      if done.is_set():
+        break
+      stack = []
+      while frame is not None and frame is not caller:
+        stack.append(FrameName(frame))
+        frame = frame.f_back
+      self.samples[(stage,) + tuple(reversed(stack))] += 1
+
+  def SecondsPerSample(self):
+    total = sum(self.samples.values())
+    return self.sampled_seconds / total if total else 0.0
+
+  def FoldedStacks(self):
+    """Lines of sampled stacks in folded format."""
+    return ['%s %d' % (';'.join(stack), count)
+            for stack, count in sorted(self.samples.items())]
+
+  def Write(self, filename):
+    """Writes folded stacks, or pstats of deterministic profile."""
+    if self.deterministic:
+      self.profile.dump_stats(filename)
+      return
+    with open(filename, 'w') as f:
+      f.write('\n'.join(self.FoldedStacks()) + '\n')
+
+  def TopFunctions(self, n=20):
+    """Functions taking the most of the time by themselves.
+
+    Returns list of dicts with function, self_seconds and total_seconds,
+    where total includes the functions it calls.
+    """
+    self_seconds = collections.Counter()
+    total_seconds = collections.Counter()
+    if self.deterministic:
+      for (filename, line, name), (_, _, tt, ct, _) in pstats.Stats(
+          self.profile).stats.items():
+        module = os.path.splitext(os.path.basename(filename))[0]
+        function = '%s:%s' % (module, name) if line else name
+        self_seconds[function] += tt
+        total_seconds[function] += ct
+    else:
+      seconds = self.SecondsPerSample()
+      for stack, count in self.samples.items():
+        if len(stack) > 1:
+          self_seconds[stack[-1]] += count * seconds
+        for function in set(stack[1:]):
+          total_seconds[function] += count * seconds
+    return [{'function': f,
+             'self_seconds': round(s, 4),
+             'total_seconds': round(total_seconds[f], 4)}
+            for f, s in self_seconds.most_common(n)]
+
+  def Summary(self, n=20):
+    return {
+      'stage_seconds': {s: round(t, 4) for s, t in self.stage_seconds.items()},
+      'top_functions': self.TopFunctions(n)
+    }
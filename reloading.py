@@ -0,0 +1,141 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hot reload of configs and their Logica programs.
+
+Watcher notices modification of config file or of the program it refers to
+and hands reloaded config to the server. Server compares rules of the old
+and the new program predicate by predicate, and drops only cached reports
+that depend on the predicates which changed.
+"""
+
+import os
+import threading
+import time
+
+from logica.parser_py import parse
+
+
+# Fields of config that change how reports are built. Change of any of them
+# invalidates all the reports of the config.
+REPORT_CONFIG_FIELDS = [
+  'fact_tables', 'default_fact_table', 'measures', 'dimensions', 'filters',
+  'dialect', 'logica_program', 'ingest_json_sources', 'ingestion_directory'
+]
+
+
+class Program:
+  """Rules and dependencies of predicates of a Logica program."""
+  def __init__(self, program_text):
+    self.rules = {}
+    self.calls = {}
+    for r in parse.ParseFile(program_text)['rule']:
+      p = r['head']['predicate_name']
+      self.rules.setdefault(p, []).append(r['full_text'])
+      self.calls.setdefault(p, set()).update(CalledPredicates(r) - {p})
+
+  @classmethod
+  def FromConfig(cls, config):
+    with open(config['logica_program']) as f:
+      return cls(f.read())
+
+
+def CalledPredicates(syntax):
+  """Names of predicates and functions called in a parsed rule."""
+  result = set()
+  if isinstance(syntax, dict):
+    if isinstance(syntax.get('predicate_name'), str):
+      result.add(syntax['predicate_name'])
+    for v in syntax.values():
+      result |= CalledPredicates(v)
+  elif isinstance(syntax, list):
+    for v in syntax:
+      result |= CalledPredicates(v)
+  return result
+
+
+def ChangedPredicates(old_program, new_program):
+  """Predicates which rules differ, or None if all of them are affected.
+
+  Annotations, e.g. @Engine or @AttachDatabase, affect all of the
+  predicates.
+  """
+  changed = set()
+  for p in set(old_program.rules) | set(new_program.rules):
+    if old_program.rules.get(p) != new_program.rules.get(p):
+      if p.startswith('@'):
+        return None
+      changed.add(p)
+  return changed
+
+
+def Dependencies(programs, roots):
+  """Predicates roots depend on in any of the programs, including roots."""
+  result = set()
+  stack = list(roots)
+  while stack:
+    p = stack.pop()
+    if p in result:
+      continue
+    result.add(p)
+    for program in programs:
+      stack.extend(program.calls.get(p, ()))
+  return result
+
+
+def ReportConfigChanged(old_config, new_config):
+  return any(old_config.get(f) != new_config.get(f)
+             for f in REPORT_CONFIG_FIELDS)
+
+
+class ConfigWatcher:
+  """Polls config files and programs, reloading modified configs.
+
+  Args:
+    config_files: List of (config filename, heart serving the config).
+    load_config: Function reading config from its file.
+    poll_seconds: Period of checking modification times.
+  """
+  def __init__(self, config_files, load_config, poll_seconds=2):
+    self.config_files = config_files
+    self.load_config = load_config
+    self.poll_seconds = poll_seconds
+
+  def Files(self, config_filename, heart):
+    return [config_filename, heart.config['logica_program']]
+
+  def Version(self, files):
+    return tuple(os.path.getmtime(f) if os.path.exists(f) else None
+                 for f in files)
+
+  def Start(self):
+    versions = {f: self.Version(self.Files(f, h))
+                for f, h in self.config_files}
+    def Watch():
+      while True:
+        time.sleep(self.poll_seconds)
+        for config_filename, heart in self.config_files:
+          version = self.Version(self.Files(config_filename, heart))
+          if version == versions[config_filename]:
+            continue
+          versions[config_filename] = version
+          heart.log.info('Reloading modified config %s.', config_filename)
+          try:
+            heart.Reload(self.load_config(config_filename))
+          except Exception:
+            heart.log.exception('Failed to reload %s, keeping previous '
+                                'version.', config_filename)
+    threading.Thread(target=Watch, daemon=True).start()
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of reloading, and of reload of the server keeping caches."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import ai
+import reloading
+import server
+import warming
+
+
+PROGRAM = '''
+@Engine("sqlite");
+Sale({region: "east", amount: 5});
+Revenue(fact) = Sum(fact.amount);
+NumSales(fact) = Sum(1);
+DoubleRevenue(fact) = 2 * Revenue(fact);
+Region(fact) = fact.region;
+'''
+
+
+class DependenciesTest(unittest.TestCase):
+
+  def testChangedPredicates(self):
+    old = reloading.Program(PROGRAM)
+    new = reloading.Program(PROGRAM.replace('Sum(1)', 'Sum(2)'))
+    self.assertEqual(reloading.ChangedPredicates(old, new), {'NumSales'})
+    self.assertEqual(reloading.ChangedPredicates(old, old), set())
+
+  def testAddedAndRemovedPredicates(self):
+    old = reloading.Program(PROGRAM)
+    new = reloading.Program(
+      PROGRAM.replace('Region(fact) = fact.region;',
+                      'Area(fact) = fact.region;'))
+    self.assertEqual(reloading.ChangedPredicates(old, new),
+                     {'Region', 'Area'})
+
+  def testChangedAnnotationAffectsEverything(self):
+    old = reloading.Program(PROGRAM)
+    new = reloading.Program(PROGRAM.replace('sqlite', 'duckdb'))
+    self.assertIsNone(reloading.ChangedPredicates(old, new))
+
+  def testDependencies(self):
+    program = reloading.Program(PROGRAM)
+    dependencies = reloading.Dependencies([program], ['DoubleRevenue'])
+    self.assertLessEqual({'DoubleRevenue', 'Revenue', 'Sum'}, dependencies)
+    self.assertNotIn('NumSales', dependencies)
+    self.assertEqual(reloading.Dependencies([program], ['Region']),
+                     {'Region'})
+
+  def testDependenciesInEitherProgram(self):
+    old = reloading.Program(PROGRAM)
+    new = reloading.Program(PROGRAM.replace('2 * Revenue(fact)',
+                                            '2 * Sum(fact.amount)'))
+    self.assertIn('Revenue',
+                  reloading.Dependencies([old, new], ['DoubleRevenue']))
+
+
+class ReloadTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    shutil.copy('test_data/sales/sales.l', self.directory)
+    self.program_path = os.path.join(self.directory, 'sales.l')
+    with open('test_data/sales/sales.json') as f:
+      self.config = json.load(f)
+    self.config['logica_program'] = self.program_path
+    self.config['log_level'] = 'warning'
+    self.heart = server.LogicLMServerHeart(
+      self.config, ai.RecordedAI.FromTranslations({}))
+    self.heart.LoadProgram()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def Request(self, measure, dimension):
+    return {'measures': [measure], 'dimensions': [dimension], 'filters': [],
+            'order': [], 'limit': -1, 'chartType': 'Table()'}
+
+  def IsCached(self, request):
+    return self.heart.compile_cache.Get(
+      ('report', self.heart.state.generation,
+       warming.CompileKey(request))) is not None
+
+  def Reload(self, old, new):
+    with open(self.program_path) as f:
+      program = f.read()
+    with open(self.program_path, 'w') as f:
+      f.write(program.replace(old, new))
+    self.heart.Reload(dict(self.config))
+
+  def testChangeInvalidatesOnlyDependentReports(self):
+    revenue = self.Request('Revenue()', 'Region()')
+    sales = self.Request('NumSales()', 'Product()')
+    self.heart.CompileJson(dict(revenue))
+    self.heart.CompileJson(dict(sales))
+    self.Reload('Revenue(fact) = Sum(fact.amount);',
+                'Revenue(fact) = Sum(fact.amount) + 0;')
+    self.assertEqual(self.heart.state.generation, 1)
+    self.assertFalse(self.IsCached(revenue))
+    self.assertTrue(self.IsCached(sales))
+
+  def testChangeOfDimensionInvalidatesReportsUsingIt(self):
+    by_region = self.Request('Revenue()', 'Region()')
+    by_product = self.Request('Revenue()', 'Product()')
+    self.heart.CompileJson(dict(by_region))
+    self.heart.CompileJson(dict(by_product))
+    self.Reload('Region(fact) = fact.region;',
+                'Region(fact) = Upper(fact.region);')
+    self.assertFalse(self.IsCached(by_region))
+    self.assertTrue(self.IsCached(by_product))
+
+  def testChangeOfConfigInvalidatesAllReports(self):
+    request = self.Request('NumSales()', 'Product()')
+    self.heart.CompileJson(dict(request))
+    self.heart.Reload(dict(self.config,
+                           dimensions=self.config['dimensions'][:-1]))
+    self.assertFalse(self.IsCached(request))
+
+  def testRecompiledReportSeesChange(self):
+    request = self.Request('Revenue()', 'Region()')
+    self.heart.CompileJson(dict(request))
+    self.Reload('Revenue(fact) = Sum(fact.amount);',
+                'Revenue(fact) = 10 * Sum(fact.amount);')
+    unused_program, unused_sql, data = self.heart.RunJson(dict(request))
+    self.assertIn(['east', 800], list(map(list, data[1:])))
+
+
+if __name__ == '__main__':
+  unittest.main()
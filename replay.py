@@ -0,0 +1,123 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load test of LogicLM server by replaying a recorded workload.
+
+Workload is recorded by the server when config has workload_log field. To
+run without LLM start the server with the recorded translations, e.g.
+
+  LOGICLM_RECORDED_AI=workload.jsonl \\
+    python3 logiclm.py examples/reach/reach.json start_server
+  python3 replay.py workload.jsonl --concurrency=8 --repeat=10
+
+Requests are sent either by a fixed number of concurrent clients, or at a
+fixed rate regardless of how fast the server responds.
+"""
+
+import argparse
+import json
+import math
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent import futures
+
+import workload
+
+
+def Percentile(sorted_values, p):
+  """Nearest-rank percentile of the sorted values."""
+  if not sorted_values:
+    return 0.0
+  rank = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+  return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def Send(server_url, record, timeout):
+  """Sends recorded request, returns latency and error or None."""
+  url = '%s%s?config=%s' % (server_url, record['path'], record['config'])
+  request = urllib.request.Request(url, data=record['body'].encode('utf-8'))
+  started_at = time.time()
+  try:
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+      result = json.loads(response.read())
+    error = result.get('nice_error')
+  except (urllib.error.URLError, OSError, ValueError) as e:
+    error = str(e)
+  return time.time() - started_at, error
+
+
+def Replay(server_url, records, concurrency=None, rate=None, timeout=600):
+  """Replays the records, returning (path, latency, error) of each."""
+  results = []
+  lock = threading.Lock()
+  def Run(record):
+    latency, error = Send(server_url, record, timeout)
+    with lock:
+      results.append((record['path'], latency, error))
+  max_workers = concurrency or 64
+  with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+    started_at = time.time()
+    for i, record in enumerate(records):
+      if rate:
+        time.sleep(max(0, started_at + i / rate - time.time()))
+      executor.submit(Run, record)
+  return results
+
+
+def Report(results, seconds):
+  print('%d requests in %.2f seconds, %.2f requests per second.' % (
+    len(results), seconds, len(results) / seconds if seconds else 0))
+  paths = sorted(set(path for path, _, _ in results))
+  print('%-22s %8s %8s %10s %10s %10s %10s' % (
+    'path', 'requests', 'errors', 'p50', 'p90', 'p99', 'max'))
+  for path in paths + ['all']:
+    latencies = sorted(latency for p, latency, _ in results
+                       if path in [p, 'all'])
+    errors = sum(1 for p, _, error in results
+                 if path in [p, 'all'] and error)
+    print('%-22s %8d %8d %9.3fs %9.3fs %9.3fs %9.3fs' % (
+      path, len(latencies), errors,
+      Percentile(latencies, 50), Percentile(latencies, 90),
+      Percentile(latencies, 99), latencies[-1] if latencies else 0))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('workload', help='Workload recorded by the server.')
+  parser.add_argument('--server', default='http://localhost:1791')
+  parser.add_argument('--concurrency', type=int, default=4,
+                      help='Number of clients sending requests.')
+  parser.add_argument('--rate', type=float,
+                      help='Requests per second to send instead.')
+  parser.add_argument('--repeat', type=int, default=1,
+                      help='Times to replay the workload.')
+  parser.add_argument('--paths', default='/understand_command,/execute_config',
+                      help='Comma separated paths of requests to replay.')
+  args = parser.parse_args()
+  paths = args.paths.split(',')
+  records = [r for r in workload.ReadWorkload(args.workload)
+             if r['path'] in paths] * args.repeat
+  started_at = time.time()
+  results = Replay(args.server, records,
+                   concurrency=None if args.rate else args.concurrency,
+                   rate=args.rate)
+  Report(results, time.time() - started_at)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests of replay."""
+
+import unittest
+
+import replay
+
+
+class PercentileTest(unittest.TestCase):
+
+  def testNearestRank(self):
+    values = list(range(1, 11))
+    self.assertEqual(replay.Percentile(values, 50), 5)
+    self.assertEqual(replay.Percentile(values, 90), 9)
+    self.assertEqual(replay.Percentile(values, 99), 10)
+    self.assertEqual(replay.Percentile(values, 100), 10)
+    self.assertEqual(replay.Percentile(values, 0), 1)
+
+  def testOddCount(self):
+    self.assertEqual(replay.Percentile([1, 2, 3], 50), 2)
+    self.assertEqual(replay.Percentile([7], 90), 7)
+
+  def testEmpty(self):
+    self.assertEqual(replay.Percentile([], 50), 0.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
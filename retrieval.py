@@ -0,0 +1,155 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Lexical index of the predicates of a config.
+
+Index is used to pick measures, dimensions and filters relevant to a
+question, so that the prompt does not have to list the whole catalog.
+Predicate names are split into words, e.g. NumberOfBabies is indexed as
+number, of, babies. Words of the name weigh more than words of the
+description.
+"""
+
+import math
+import re
+
+
+STOP_WORDS = set("""
+a all an and are as at bar be bottom broken by chart do each for from give
+graph how i in is it least line list me most of on or over per pie please show
+table the their them to top versus vs what which with
+""".split())
+
+# Words of questions that refer to dates, e.g. "in July 2024".
+DATE_WORDS = set("""
+january february march april may june july august september october november
+december year month week day daily weekly monthly yearly today yesterday
+""".split())
+
+NAME_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Config field, predicate call field of its entries.
+CATALOG_KINDS = [
+  ('measures', 'aggregating_function'),
+  ('dimensions', 'function'),
+  ('filters', 'predicate')
+]
+
+
+def Stem(word):
+  if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+    return word[:-1]
+  return word
+
+
+def Words(text):
+  """Lowercase stemmed words of the text, CamelCase names are split."""
+  text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', text)
+  return [Stem(w) for w in re.findall(r'[a-z0-9]+', text.lower())]
+
+
+def ContentWords(text):
+  """Words of the question to look up in the index.
+
+  Each word is given with alternatives it may be indexed as, e.g. a month
+  can match a date or a year predicate.
+  """
+  result = []
+  for w in Words(text):
+    if w in DATE_WORDS or re.fullmatch(r'(19|20)\d\d', w):
+      result.append((w, 'date', 'year'))
+    elif w not in STOP_WORDS and not w.isdigit():
+      result.append((w,))
+  return result
+
+
+class CatalogEntry:
+  def __init__(self, kind, entry, predicate_name):
+    self.kind = kind
+    self.entry = entry
+    self.predicate_name = predicate_name
+    self.weights = {}
+    for w in Words(entry.get('description', '')):
+      self.weights[w] = DESCRIPTION_WEIGHT
+    for w in Words(predicate_name):
+      self.weights[w] = NAME_WEIGHT
+
+
+class Selection:
+  """Entries of the catalog selected for a question."""
+  def __init__(self, entries, confidence, fallback):
+    self.entries = entries
+    self.confidence = confidence
+    self.fallback = fallback
+
+  def SelectedConfig(self, config):
+    """Config with only the selected measures, dimensions and filters."""
+    result = dict(config)
+    for kind, _ in CATALOG_KINDS:
+      result[kind] = self.entries[kind]
+    return result
+
+
+class PromptIndex:
+  def __init__(self, config):
+    self.config = config
+    self.catalog = []
+    for kind, call_field in CATALOG_KINDS:
+      for entry in config[kind]:
+        self.catalog.append(
+          CatalogEntry(kind, entry, entry[call_field]['predicate_name']))
+    document_frequency = {}
+    for e in self.catalog:
+      for w in e.weights:
+        document_frequency[w] = document_frequency.get(w, 0) + 1
+    self.idf = {w: math.log(1 + len(self.catalog) / f)
+                for w, f in document_frequency.items()}
+
+  def Score(self, catalog_entry, words):
+    return sum(max(catalog_entry.weights.get(a, 0) * self.idf.get(a, 0)
+                   for a in alternatives)
+               for alternatives in words)
+
+  def Select(self, question, top_k=5, min_confidence=0.75):
+    """Selects top_k entries of each kind relevant to the question.
+
+    Confidence is the fraction of content words of the question known to the
+    index. Unknown words are often values, e.g. a state name, which need a
+    filter we can't tell, so when confidence is under min_confidence the
+    whole catalog is selected. Request can't do without measures and
+    dimensions, so these are padded up to top_k in catalog order.
+    """
+    words = ContentWords(question)
+    known = [alternatives for alternatives in words
+             if any(a in self.idf for a in alternatives)]
+    confidence = len(known) / len(words) if words else 0.0
+    fallback = confidence < min_confidence
+    entries = {}
+    for kind, _ in CATALOG_KINDS:
+      if fallback:
+        entries[kind] = self.config[kind]
+        continue
+      scored = [(self.Score(e, known), i, e)
+                for i, e in enumerate(self.catalog) if e.kind == kind]
+      top = sorted([s for s in scored if s[0] > 0], key=lambda s: -s[0])
+      top = top[:top_k]
+      if kind != 'filters':
+        chosen = set(i for _, i, _ in top)
+        top += [s for s in scored if s[1] not in chosen][:top_k - len(top)]
+      # Keeping catalog order, as in the full prompt.
+      entries[kind] = [e.entry for _, _, e in sorted(top, key=lambda s: s[1])]
+    return Selection(entries, confidence, fallback)
@@ -20,6 +20,7 @@ import json
 import logiclm
 import io
 import sys
+import unittest
 from logica.common import color
 
 def ShowFirstDifference(a, b):
@@ -48,7 +49,7 @@ def RunTest(test_file, golden_run):
           test_config['config'],
           test_config['command']] + (
             [json.dumps(test_config['request'])]
-            if 'request' in test_config else [])
+            if 'request' in test_config else []) + test_config.get('flags', [])
   true_stdout = sys.stdout
   mock_stdout = io.StringIO()
   sys.stdout = mock_stdout
@@ -72,7 +73,22 @@ def RunTest(test_file, golden_run):
       ShowFirstDifference(result, golden)
 
 
+def RunUnitTests(test_file):
+  print('%-70s %s' % (test_file, color.Format('{warning}RUNNING{end}')))
+  suite = unittest.defaultTestLoader.loadTestsFromName(test_file[:-len('.py')])
+  stream = io.StringIO()
+  result = unittest.TextTestRunner(stream=stream).run(suite)
+  print('\033[F', end='')
+  if result.wasSuccessful():
+    print('%-70s %s' % (test_file, color.Format('{ok}PASS   {end}')))
+  else:
+    print('%-70s %s' % (test_file, color.Format('{error}FAIL   {end}')))
+    print(stream.getvalue())
+
+
 test_files = glob.glob('test_data/integration_tests/*.txt')
 for test_file in test_files:
   golden_run = 'golden_run' in sys.argv
-  RunTest(test_file, golden_run)
\ No newline at end of file
+  RunTest(test_file, golden_run)
+for test_file in sorted(glob.glob('*_test.py')):
+  RunUnitTests(test_file)
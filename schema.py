@@ -24,6 +24,9 @@ def String():
 def Number():
   return {'type': 'number'}
 
+def Boolean():
+  return {'type': 'boolean'}
+
 def Object(properties):
   return {'type': 'object',
           'properties': properties}
@@ -49,7 +52,13 @@ def List(x):
 def Measure():
   return Object({
     'aggregating_function': PredicateSignature(),
-    'fact_table': String()
+    'fact_table': String(),
+    'scale_in_preview': Boolean(),
+    'mergeable': Object({
+      'kind': {'enum': ['sum', 'count_distinct']},
+      'value': String(),
+      'factor': String()
+    })
   })
 
 def Dimension():
@@ -82,6 +91,15 @@ def FactTable():
     }),
     'ephemeral_dimensions': List(String()),
     'hostile_dimensions': List(String()),
+    'preview': Object({
+      'sample': String(),
+      'sampling_factor': Number()
+    }),
+    'incremental': Object({
+      'watermark': String(),
+      'cumulative_dimensions': {'type': 'object',
+                                'additionalProperties': String()}
+    }),
   })
 
 def OlapConfig():
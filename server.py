@@ -16,36 +16,115 @@
 
 
 import cgi
+import copy
+from concurrent import futures
 import json
 from http import server
+import select
+import socket
 import socketserver
+import threading
 import traceback
 import time
 import os
-import tempfile
 from urllib import parse
 import ai
+import assets
+import caching
+import compiling
+import cost
+import execution
+import incremental
+import inmemory
+import logs
+import matcher
 import olap
+import profiling
+import reloading
+import retrieval
+import warming
+import workload
 from logica.tools import run_in_terminal
-from logica.parser_py import parse as parse_logica
-from logica.compiler import rule_translate
-from logica.type_inference.research import infer
 from logica.common import sqlite3_logica
 
-from logica.common import color
-import io
+
+class HeartState:
+  """Config of the heart and everything built from it.
+
+  Reload builds new state and swaps it in with a single assignment, so a
+  request works with one version of config, program, engines and compile
+  pool throughout.
+  """
+  def __init__(self, config, generation, program=None, logger_name=None):
+    self.config = config
+    # Version of the config, part of keys of compiled reports.
+    self.generation = generation
+    # Rules of the program, to tell which reports a reload affects.
+    self.program = program
+    self.log = logs.ConfigLogger(config, logger_name)
+    self.prompt_template = ai.GetPromptTemplate(config)
+    # Large configs list only predicates relevant to the question in prompt.
+    self.prompt_index = (retrieval.PromptIndex(config)
+                         if config.get('prompt_top_k') else None)
+    # With offline_matcher set simple requests are understood locally,
+    # without waiting for the LLM.
+    self.matcher = (matcher.Matcher(config)
+                    if config.get('offline_matcher') else None)
+    self.in_memory_engine = (inmemory.InMemoryEngine(config)
+                             if config.get('in_memory_engine') else None)
+    self.incremental_engine = (
+      incremental.IncrementalEngine(config)
+      if incremental.IncrementalFactTables(config) else None)
+    self.compile_pool = compiling.CompilePool.ForConfig(config)
+
+  def Replace(self, **fields):
+    """Copy of the state with the fields replaced."""
+    state = copy.copy(self)
+    state.__dict__.update(fields)
+    return state
 
 
 class LogicLMServerHeart:
-  def __init__(self, config):
+  def __init__(self, config, nous=None):
     self.request_counter = 0
-    self.nous = ai.AI.Get()
-    self.prompt_template = ai.GetPromptTemplate(config)
-    self.config = config
-    color.CHR_ERROR = '<span style="color:red;">'
-    color.CHR_END = '</span>'
-    color.CHR_WARNING = '<span style="font-weight: bold">'
-    color.CHR_UNDERLINE = '<span style="font-weight: bold;">'
+    self.nous = nous or ai.AI.Get()
+    logs.Start(config)
+    self.state = HeartState(config, 0)
+    self.reload_lock = threading.Lock()
+    self.dashboard_warmer = None
+    # Rendered page and logo, built when first requested.
+    self.assets = None
+    self.assets_lock = threading.Lock()
+    self.workload_recorder = (
+      workload.WorkloadRecorder.ForPath(config['workload_log'])
+      if config.get('workload_log') else None)
+    self.prompt_statistics_lock = threading.Lock()
+    self.prompt_statistics = {'prompts': 0, 'fallbacks': 0,
+                              'full_tokens': 0, 'compact_tokens': 0}
+    # Compiled reports and executions are kept within the budget of config.
+    self.compile_cache = caching.BoundedCache(
+      config.get('compile_cache_megabytes', 64) * 2**20)
+    self.connection_pool = execution.ConnectionPool(
+      config.get('max_idle_connections', 4))
+    self.execution_flights = caching.SingleFlight()
+    self.understanding_flights = caching.SingleFlight()
+    self.fact_table_statistics = cost.FactTableStatistics(
+      config.get('statistics_ttl_seconds', 3600))
+    compiling.UseHtmlColors()
+
+  @property
+  def config(self):
+    return self.state.config
+
+  @property
+  def log(self):
+    return self.state.log
+
+  def LoadProgram(self):
+    """Reads rules of the program, so that reloads tell what they affect."""
+    with self.reload_lock:
+      self.state = self.state.Replace(
+        program=reloading.Program.FromConfig(self.config))
 
   def StaticFilename(self, filename):
     return os.path.dirname(__file__) + '/html/' + filename
@@ -97,6 +176,17 @@ class LogicLMServerHeart:
     with open(self.StaticFilename('logiclm.png'), 'rb') as logo_file:
       return logo_file.read()
 
+  def Assets(self):
+    """Static assets by path, built once per version of the config."""
+    with self.assets_lock:
+      if self.assets is None:
+        self.assets = {
+          '/index.html': assets.Asset(bytes(self.Html(), 'utf8'),
+                                      'text/html; charset=utf-8'),
+          '/logiclm.png': assets.Asset(self.LogoPng(), 'image/png')
+        }
+      return self.assets
+
   # TODO: Refactor this.
   def LegacyIntelligenceConfig(self):
     intelligence_config = {}
@@ -111,6 +201,8 @@ class LogicLMServerHeart:
         {'predicateName': d['predicate']['predicate_name']}
         for d in self.config['filters']]
     intelligence_config['dashboard'] = bool(self.config['dashboard'])
+    intelligence_config['preview'] = any(
+      'preview' in t for t in self.config['fact_tables'])
     intelligence_config['aiVisualizationRequest'] = {
       'chartTypes': [
         {'chartTypeName': p['predicate']['predicate_name']}
@@ -118,121 +210,516 @@ class LogicLMServerHeart:
     }
     return intelligence_config
 
+  def StartWarmingDashboard(self):
+    """Keeps dashboard charts warm, unless config disables it."""
+    if not self.config.get('dashboard_prewarm', True):
+      return
+    self.dashboard_warmer = warming.DashboardWarmer(
+      self, self.config.get('dashboard_refresh_seconds', 600),
+      self.config.get('dashboard_workers'))
+    self.dashboard_warmer.Start()
+
+  def ReportPredicates(self, o):
+    """Predicates the report of the Olap is built from."""
+    calls = o.measures + o.dimensions + o.filters + o.order
+    predicates = {o.CalledPredicate(c) for c in calls}
+    predicates |= set(o.relevant_fact_tables)
+    for t in o.relevant_fact_tables:
+      if t in o.preview_of_table:
+        predicates.add(o.CalledPredicate(o.preview_of_table[t]['sample']))
+    return predicates
+
+  def Reload(self, config):
+    """Switches to modified config, keeping caches the change can't affect."""
+    with self.reload_lock:
+      self.SwitchTo(config)
+
+  def SwitchTo(self, config):
+    old = self.state
+    program = reloading.Program.FromConfig(config)
+    if old.program is None or reloading.ReportConfigChanged(old.config,
+                                                            config):
+      changed = None
+    else:
+      changed = reloading.ChangedPredicates(old.program, program)
+    programs = [p for p in [old.program, program] if p]
+    def IsStale(predicates):
+      return (changed is None or
+              bool(reloading.Dependencies(programs, predicates) & changed))
+    def IsAffected(o):
+      return IsStale(self.ReportPredicates(o))
+    def IsStaleFactTable(fact_table):
+      return IsStale([fact_table])
+    def IsAffectedRequest(json_request):
+      try:
+        return IsAffected(olap.Olap(config, json_request))
+      except Exception:
+        return True
+    state = HeartState(config, old.generation + 1, program,
+                       logger_name=old.log.name)
+    if state.in_memory_engine and old.in_memory_engine:
+      state.in_memory_engine.AdoptTables(old.in_memory_engine,
+                                         IsStaleFactTable)
+    if state.incremental_engine and old.incremental_engine:
+      state.incremental_engine.AdoptAggregates(old.incremental_engine, IsStale)
+    self.fact_table_statistics.Invalidate(IsStaleFactTable)
+    # Reports the change can't affect move to the new generation, others,
+    # including ones still being compiled with the old config, are dropped.
+    def NewKey(key, value):
+      if key[0] != 'report':
+        return key
+      if key[1] != old.generation or IsAffected(value[0]):
+        return None
+      return ('report', state.generation) + key[2:]
+    dropped = self.compile_cache.Rekey(NewKey)
+    self.state = state
+    # Compilations that already took the old pool finish, later ones run in
+    # the server process.
+    if old.compile_pool:
+      old.compile_pool.Shutdown()
+    with self.assets_lock:
+      self.assets = None
+    if self.dashboard_warmer:
+      self.dashboard_warmer.Reload(config, IsAffectedRequest)
+    self.log.info('Reloaded config.', extra={'fields': {
+      'changed': ('all predicates' if changed is None else
+                  ', '.join(sorted(changed)) or 'no predicates'),
+      'dropped_compiled_reports': dropped}})
+
+  def PromptTemplate(self, user_request):
+    state = self.state
+    if not state.prompt_index:
+      return state.prompt_template
+    template, statistics = ai.GetCompactPromptTemplate(
+      state.config, user_request, state.prompt_index,
+      state.config['prompt_top_k'],
+      state.config.get('prompt_min_confidence', 0.75))
+    with self.prompt_statistics_lock:
+      totals = self.prompt_statistics
+      totals['prompts'] += 1
+      totals['fallbacks'] += statistics['fallback']
+      totals['full_tokens'] += statistics['full_tokens']
+      totals['compact_tokens'] += statistics['compact_tokens']
+      self.log.info('Compact prompt.', extra={'fields': {
+        'prompt_size': statistics, 'prompts_so_far': dict(totals)}})
+    return template
+
   def NaturalLanguageToRequestJson(self, user_request):
-    json_request_str = self.nous(self.prompt_template.replace('__USER_REQUEST__',
-                                                              user_request))
-    print('AI response:', json_request_str)
-    json_request = json.loads(json_request_str)
+    matcher = self.state.matcher
+    json_request = matcher and matcher.Understand(user_request)
+    if json_request:
+      self.log.info('Understood offline.',
+                    extra={'fields': {'request': dict(json_request)}})
+    else:
+      prompt = self.PromptTemplate(user_request).replace(
+        '__USER_REQUEST__', user_request)
+      json_request_str = self.understanding_flights.Do(
+        caching.RequestKey(prompt), lambda: self.nous(prompt))
+      self.log.info('AI response.',
+                    extra={'fields': {'response': json_request_str}})
+      json_request = json.loads(json_request_str)
     json_request['exampleQuery'] = user_request
     # TODO: Change HTML to understand raw config.
     json_request['intelligence_config'] = self.LegacyIntelligenceConfig()
     return json_request
   
-  def RunJson(self, json_request):
-    if len(json_request['measures']) == 0:
-      # TODO: We should add NumRecords by default or
-      # allow requests without measures.
-      json_request['measures'] = ['NumRecords()']
-    if len(json_request['dimensions']) == 0:
-      json_request['dimensions'] = ['Total()']
-    if len(json_request['dimensions']) < 1 or len(json_request['measures']) < 1:
-      json_request['nice_error'] = '<i>Please specify at least one measure and at least one dimension.</i>'
-      return 'Fail(true)', "select 'fail'", []
+  def CompileJson(self, json_request, in_process=False, state=None):
+    """Builds Olap, logic program and SQL of the request.
+
+    Request is compiled with the given state, current one by default. With
+    in_process set the request is compiled in the server process even if
+    there are compile workers, e.g. so that profile sees the compiler.
+    Returns None if request does not compile, setting nice_error.
+    """
+    state = state or self.state
+    key = ('report', state.generation, warming.CompileKey(json_request))
+    cached = self.compile_cache.Get(key)
+    if cached:
+      o, logic_program, sql, chart_type_predicate_call = cached
+      json_request['chart_type_predicate_call'] = chart_type_predicate_call
+      return o, logic_program, sql
+    compiled = self.CompileJsonUncached(json_request, state, in_process)
+    if compiled:
+      o, logic_program, sql = compiled
+      self.compile_cache.Put(
+        key, compiled + (json_request['chart_type_predicate_call'],),
+        len(logic_program) + len(sql))
+    return compiled
 
-    o = olap.Olap(self.config, json_request)
+  def CompileJsonUncached(self, json_request, state, in_process=False):
+    o = olap.Olap(state.config, json_request)
     charting_call = o.AsPredicateCall(json_request['chartType'])
     json_request['chart_type_predicate_call'] = {
       'predicate_name': charting_call.predicate_name,
       'arguments': {k: v.AsJson() for k, v in charting_call.named_args.items()}
     }
+    result = None
+    if state.compile_pool and not in_process:
+      try:
+        result = state.compile_pool.Compile(json_request)
+      except futures.process.BrokenProcessPool as e:
+        self.log.warning('Compile workers failed, compiling in server.',
+                         extra={'fields': {'error': str(e)}})
+        with self.reload_lock:
+          if self.state is state:
+            self.state = state.Replace(compile_pool=None)
+      if result:
+        # Builds the report structure the execution needs, e.g. sampling.
+        o.GetLogicProgram()
+    logic_program, sql, compiled, failure, nice_error = (
+      result or compiling.Compile(o))
+    if failure:
+      json_request['nice_error'] = nice_error
+      self.log.warning(failure, extra={'fields': {'error': nice_error}})
+      return None
+    # Execution runs what was compiled here, rather than compiling again.
+    for program, executions in compiled:
+      execution.CacheExecutions(self.compile_cache, logic_program, program,
+                                executions)
+    self.log.debug('Logic program.',
+                   extra={'fields': {'logic_program': logic_program}})
+    return o, logic_program, sql
+
+  def ApplyCostGuardrail(self, json_request, o, logic_program, sql,
+                         cancellation=None, state=None):
+    """Rejects or downgrades requests estimated to be over the budget.
+
+    Queries of the estimation run under cancellation of the request, and
+    downgraded request is compiled with the state of the request.
+    Returns Olap, logic program and SQL to run, or None if request is
+    rejected, setting nice_error.
+    """
+    state = state or self.state
+    config = state.config
+    max_rows = config['max_estimated_rows']
     try:
-      logic_program = str(o.GetFullLogicProgram())
-    except parse_logica.ParsingException as e:
-      print('Failure of parsing:')
-      e.ShowMessage()
-      s = io.StringIO()
-      e.ShowMessage(stream=s)
-      json_request['nice_error'] = s.getvalue()
-      return 'Fail(true)', "select 'fail'", [] 
-
-    print('Logic program:')
-    print(logic_program)
+      estimate = cost.EstimateCost(
+        o, logic_program, self.fact_table_statistics,
+        config.get('fan_out_estimate', cost.DEFAULT_FAN_OUT),
+        cancellation=cancellation, pool=self.connection_pool,
+        cache=self.compile_cache)
+    except execution.QueryCancelled:
+      raise
+    except Exception as e:
+      self.log.warning('Failure of cost estimation, running request as is.',
+                       extra={'fields': {'error': str(e)}})
+      return o, logic_program, sql
+    self.log.info('Cost estimate.', extra={'fields': {'estimate': estimate}})
+    if estimate.rows <= max_rows:
+      return o, logic_program, sql
+    message = ('This request is estimated to process about %d rows, '
+               'which is over the budget of %d rows.' % (estimate.rows,
+                                                         max_rows))
+    action = config.get('cost_overrun_action', 'reject')
+    if action == 'preview' and not o.preview:
+      json_request['preview'] = True
+      json_request['cost_warning'] = message + ' Showing sampled preview.'
+      return self.CompileJson(json_request, state=state)
+    if action == 'limit':
+      limit = config.get('cost_overrun_limit', 1000)
+      if 0 <= o.limit <= limit:
+        return o, logic_program, sql
+      json_request['limit'] = limit
+      json_request['cost_warning'] = message + ' Showing first %d rows.' % limit
+      return self.CompileJson(json_request, state=state)
+    json_request['nice_error'] = (
+      '<i>%s Please narrow it down, e.g. with filters or a shorter '
+      'date range.</i>' % message)
+    return None
 
+  def ExecuteConfig(self, json_request, cancellation=None):
+    """Runs the request, returning response to send to the client.
+
+    Request with profile field set is profiled, and the response gets
+    seconds of its stages and its hottest functions as profile_report.
+    """
+    profile = profiling.Profile() if json_request.get('profile') else None
     try:
-      sql = o.GetSQL()
-    except parse_logica.ParsingException as e:
-      print('Failure of parsing when building SQL:')
-      e.ShowMessage()
-      s = io.StringIO()
-      e.ShowMessage(stream=s)
-      json_request['nice_error'] = s.getvalue()
-      return 'Fail(true)', "select 'fail'", []
-    except rule_translate.RuleCompileException as e:
-      print('Failure of compilation when building SQL:')
-      e.ShowMessage()
-      s = io.StringIO()
-      e.ShowMessage(stream=s)
-      json_request['nice_error'] = s.getvalue()
+      logic_program, sql, data = self.RunJson(json_request, cancellation,
+                                              profile)
+      response = json_request | {
+        'data': data,
+        'sql': sql,
+        'logical_program': logic_program,
+      }
+    except KeyError as e:
+      response = json_request | {
+        'nice_error': 'Silly LLM produced an unknown entity: ' + str(e)
+      }
+      self.log.exception('Unknown entity in request.')
+    except Exception as e:
+      response = json_request | {
+        'nice_error': 'Ouch, I have got an error:' + str(e)
+      }
+      self.log.exception('Failure of running request.')
+    if profile:
+      response['profile_report'] = profile.Summary(
+        self.config.get('profile_top_functions', 20))
+    return response
+
+  def RunInMemory(self, state, o, cancellation):
+    """Returns header and rows computed in memory, or None to run SQL."""
+    if not state.in_memory_engine:
+      return None
+    try:
+      return state.in_memory_engine.Run(o, cancellation)
+    except inmemory.UnsupportedReport as e:
+      self.log.debug('Running SQL, as in-memory engine can not run report.',
+                     extra={'fields': {'reason': str(e)}})
+      return None
+
+  def RunIncremental(self, state, o, json_request, cancellation):
+    """Returns header and rows from kept aggregates, or None to run SQL."""
+    if not state.incremental_engine:
+      return None
+    try:
+      result, approximate = state.incremental_engine.Run(
+        o, cancellation, pool=self.connection_pool, cache=self.compile_cache)
+    except inmemory.UnsupportedReport as e:
+      self.log.debug('Running SQL, as report can not be computed from kept '
+                     'aggregates.', extra={'fields': {'reason': str(e)}})
+      return None
+    if approximate:
+      json_request['approximate'] = True
+    return result
+
+  def Run(self, state, o, logic_program, cancellation, arrow, json_request):
+    """Header and rows of the report, compiled with the state."""
+    incremental_result = self.RunIncremental(state, o, json_request,
+                                             cancellation)
+    if incremental_result:
+      return incremental_result
+    in_memory_result = self.RunInMemory(state, o, cancellation)
+    if in_memory_result:
+      return in_memory_result
+    if (state.config.get('parallel_execution') and
+        len(o.MeasureTablePredicates()) > 1):
+      return execution.RunInParallel(
+        o, logic_program, state.config.get('parallel_workers'),
+        cancellation=cancellation, pool=self.connection_pool,
+        cache=self.compile_cache, arrow=arrow)
+    return execution.RunPredicate(
+      logic_program, 'Report', cancellation=cancellation,
+      pool=self.connection_pool, cache=self.compile_cache, arrow=arrow)
+
+  def RunJson(self, json_request, cancellation=None, profile=None):
+    if len(json_request['measures']) == 0:
+      # TODO: We should add NumRecords by default or
+      # allow requests without measures.
+      json_request['measures'] = ['NumRecords()']
+    if len(json_request['dimensions']) == 0:
+      json_request['dimensions'] = ['Total()']
+    if len(json_request['dimensions']) < 1 or len(json_request['measures']) < 1:
+      json_request['nice_error'] = '<i>Please specify at least one measure and at least one dimension.</i>'
       return 'Fail(true)', "select 'fail'", []
-    except infer.TypeErrorCaughtException as e:
-      print('Failure of typing when building SQL:')
-      e.ShowMessage()
-      s = io.StringIO()
-      e.ShowMessage(stream=s)
-      json_request['nice_error'] = s.getvalue()
+
+    # Request is served with one version of the config throughout.
+    state = self.state
+    config = state.config
+    with profiling.Stage(profile, 'compile'):
+      # Functions run by compile workers would not be seen by the profile.
+      compiled = self.CompileJson(
+        json_request, in_process=bool(profile and profile.traces_functions),
+        state=state)
+    if not compiled:
       return 'Fail(true)', "select 'fail'", []
+    o, logic_program, sql = compiled
 
-    with  tempfile.TemporaryDirectory('LogicLM') as temp_dir:
-      temp_file = '%s/report.l' % temp_dir
-      with open(temp_file, 'w') as w:
-        w.write(logic_program)
-      header, rows = run_in_terminal.Run(temp_file, 'Report', output_format='header_rows')
+    cancellation = cancellation or execution.Cancellation()
+    # DuckDB results stay in Arrow until the response is built.
+    arrow = (config.get('arrow_results', True) and
+             execution.ArrowAvailable())
+    # Time limit covers estimation of the cost as well as the execution.
+    timeout = config.get('query_timeout_seconds')
+    timer = cancellation.CancelAfter(timeout) if timeout else None
+    try:
+      if config.get('max_estimated_rows'):
+        with profiling.Stage(profile, 'cost_estimation'):
+          compiled = self.ApplyCostGuardrail(json_request, *compiled,
+                                             cancellation=cancellation,
+                                             state=state)
+        if not compiled:
+          return logic_program, sql, []
+        o, logic_program, sql = compiled
+      with profiling.Stage(profile, 'execution'):
+        header, rows = self.Run(state, o, logic_program, cancellation, arrow,
+                                json_request)
+    except execution.QueryCancelled as e:
+      self.log.info('Query cancelled.', extra={'fields': {'reason': str(e)}})
+      json_request['nice_error'] = '<i>Query was cancelled. %s</i>' % e
+      return logic_program, sql, []
+    finally:
+      if timer:
+        timer.cancel()
+    rows = execution.Rows(rows)
     data = [header] + rows
-    print('Data:', data)
-    print(sqlite3_logica.ArtisticTable(header, rows))
+    if o.IsApproximate():
+      json_request['approximate'] = True
+    # Only a sample of the rows is logged, table is rendered by the logging
+    # thread.
+    sampled_rows = logs.Lazy(lambda: sqlite3_logica.ArtisticTable(
+      header, logs.SampledRows(rows, config.get('log_max_rows', 10))))
+    self.log.info('Report data.', extra={'fields': {
+      'columns': header, 'rows': len(rows), 'sampled_rows': sampled_rows}})
     return logic_program, sql, data
 
 
-def MakeSimpleLogicLMServer(config):
-  heart = LogicLMServerHeart(config)
+CLIENT_DISCONNECTED = 'Client disconnected.'
+
+
+def WatchClientDisconnect(connection, on_disconnect):
+  """Calls on_disconnect when client closes connection.
+
+  Returns event, which should be set when the request is served.
+  """
+  done = threading.Event()
+  def Watch():
+    while not done.is_set():
+      try:
+        readable, _, _ = select.select([connection], [], [], 0.5)
+        if not readable:
+          continue
+        if connection.recv(1, socket.MSG_PEEK):
+          # Client is sending more data, so it is still there.
+          return
+      except (OSError, ValueError):
+        return
+      if not done.is_set():
+        on_disconnect()
+      return
+  threading.Thread(target=Watch, daemon=True).start()
+  return done
+
+
+def MakeHearts(config, hosted_configs=None):
+  """Builds heart of each config, sharing the AI between them.
+
+  Returns heart of the main config, hearts by their config parameter and
+  hearts by id of their config.
+  """
+  nous = ai.AI.Get()
+  main_heart = LogicLMServerHeart(config, nous)
+  hearts_by_config = {id(config): main_heart}
+  hearts = {}
+  for name, hosted_config in (hosted_configs or {}).items():
+    if id(hosted_config) not in hearts_by_config:
+      hearts_by_config[id(hosted_config)] = LogicLMServerHeart(hosted_config,
+                                                               nous)
+    hearts[name] = hearts_by_config[id(hosted_config)]
+  for heart in hearts_by_config.values():
+    heart.StartWarmingDashboard()
+  return main_heart, hearts, hearts_by_config
+
+
+def MakeSimpleLogicLMServer(config, hosted_configs=None):
+  main_heart, hearts, hearts_by_config = MakeHearts(config, hosted_configs)
   class SimpleLogicLMServer(server.SimpleHTTPRequestHandler):
-    def __init__(self, request, client_address, server):
-      self.heart = heart
-      super().__init__(request, client_address, server)
+    def RouteToHeart(self, url):
+      """Sets heart of the config requested by the page, if it is known."""
+      config_name = parse.parse_qs(url.query).get('config', ['null'])[0]
+      if config_name in ['null', '']:
+        self.heart = main_heart
+      else:
+        self.heart = hearts.get(config_name)
+      if self.heart:
+        return True
+      self.send_response(404)
+      self.send_header('Content-type', 'text/plain')
+      self.end_headers()
+      self.wfile.write(bytes('Unknown config %s, served configs are: %s.' % (
+        config_name, ', '.join(sorted(hearts))), 'utf8'))
+      return False
+
+    def log_message(self, format, *args):
+      getattr(self, 'heart', main_heart).log.info(
+        '%s ' + format, self.address_string(), *args)
+
+    def SendAsset(self, asset):
+      # Clients revalidate, so that they see reloaded configs.
+      not_modified = asset.NotModified(self.headers.get('If-None-Match'),
+                                       self.headers.get('If-Modified-Since'))
+      self.send_response(304 if not_modified else 200)
+      self.send_header('Content-type', asset.content_type)
+      self.send_header('ETag', asset.etag)
+      self.send_header('Last-Modified', asset.last_modified)
+      self.send_header('Cache-Control', 'no-cache')
+      self.send_header('Vary', 'Accept-Encoding')
+      if not_modified:
+        self.end_headers()
+        return
+      encoding, body = asset.Body(self.headers.get('Accept-Encoding'))
+      if encoding:
+        self.send_header('Content-Encoding', encoding)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def RecordWorkload(self, url, body, started_at, response=None):
+      if not self.heart.workload_recorder:
+        return
+      config_name = parse.parse_qs(url.query).get('config', ['null'])[0]
+      self.heart.workload_recorder.Record(
+        started_at, url.path, config_name, body, time.time() - started_at,
+        response)
 
     def do_POST(self) -> None:
+      started_at = time.time()
       url = parse.urlparse(self.path)
+      if not self.RouteToHeart(url):
+        return
       ctype, pdict = cgi.parse_header(self.headers.get('content-type'))
       if url.path == '/understand_command':
         user_request = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
-        print('User request:', user_request)
+        self.heart.log.info('User request.',
+                            extra={'fields': {'request': user_request}})
         json_request = self.heart.NaturalLanguageToRequestJson(user_request)
-        print('LLM translation:', json.dumps(json_request, indent=' '))
+        self.heart.log.info('LLM translation.',
+                            extra={'fields': {'request': dict(json_request)}})
+        self.RecordWorkload(url, user_request, started_at, json_request)
         self.send_response(200)
         self.send_header('Content-type', 'text/plain')
         self.end_headers()
         self.wfile.write(bytes(json.dumps(json_request), 'utf8'))
       if url.path == '/execute_config':
-        json_request = json.loads(
-          self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
-        print('JSON request:', json_request)
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode(
+          'utf-8')
+        json_request = json.loads(body)
+        self.heart.log.info('JSON request.',
+                            extra={'fields': {'request': dict(json_request)}})
+        warm_response = (self.heart.dashboard_warmer and
+                         not json_request.get('profile') and
+                         self.heart.dashboard_warmer.Get(json_request))
+        if warm_response:
+          self.RecordWorkload(url, body, started_at)
+          self.heart.log.info('Serving warm dashboard chart.')
+          self.send_response(200)
+          self.send_header('Content-type', 'text/plain')
+          self.end_headers()
+          self.wfile.write(bytes(json.dumps(warm_response), 'utf8'))
+          return
+        # Identical concurrent requests share one computation. It is
+        # cancelled only when all of the clients waiting for it are gone.
+        key = caching.RequestKey(json_request)
+        flight, leader = self.heart.execution_flights.Join(key)
+        cancellation = execution.Cancellation()
+        if leader:
+          flight.OnAbandoned(lambda: cancellation.Cancel(CLIENT_DISCONNECTED))
+        disconnected = threading.Event()
+        def OnDisconnect():
+          disconnected.set()
+          flight.Leave()
+        watching = WatchClientDisconnect(self.connection, OnDisconnect)
         try:
-          logic_program, sql, data = self.heart.RunJson(json_request)
-          response = json_request | {
-            'data': data,
-            'sql': sql,
-            'logical_program': logic_program,
-          }
-        except KeyError as e:
-          response = json_request | {
-            'nice_error': 'Silly LLM produced an unknown entity: ' + str(e)
-          }
-          print(traceback.format_exc())
-        except Exception as e:
-          response = json_request | {
-            'nice_error': 'Ouch, I have got an error:' + str(e)
-          }
-          print(traceback.format_exc())
+          if leader:
+            self.heart.execution_flights.Fly(
+              key, flight,
+              lambda: self.heart.ExecuteConfig(json_request, cancellation))
+          response = flight.Result()
+        finally:
+          watching.set()
+        self.RecordWorkload(url, body, started_at)
+        if disconnected.is_set():
+          return
         self.send_response(200)
         self.send_header('Content-type', 'text/plain')
         self.end_headers()
@@ -240,22 +727,16 @@ def MakeSimpleLogicLMServer(config):
 
     def do_GET(self) -> None:
       url = parse.urlparse(self.path)
+      if not self.RouteToHeart(url):
+        return
       supported_paths = ['/index.html', '/logiclm.png']
       if url.path not in supported_paths:
         path = '/index.html'
       else:
         path = url.path
-      if path == '/index.html':
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(bytes(self.heart.Html(), 'utf8'))
-        return
-      if path == '/logiclm.png':
-        self.send_response(200)
-        self.send_header('Content-type', 'image/png')
-        self.end_headers()
-        self.wfile.write(self.heart.LogoPng())
+      asset = self.heart.Assets().get(path)
+      if asset:
+        self.SendAsset(asset)
         return
 
       self.send_response(200)
@@ -264,6 +745,7 @@ def MakeSimpleLogicLMServer(config):
       self.wfile.write(bytes('Congratulations! You achieved impossible!', 'utf8'))
       self.heart.request_counter += 1
 
+  SimpleLogicLMServer.hearts_by_config = hearts_by_config
   return SimpleLogicLMServer
 
 
@@ -273,12 +755,42 @@ class ThreadedTCPServer(socketserver.ThreadingMixIn,
     pass
 
 
-def StartServer(config):
-  simple_server = MakeSimpleLogicLMServer(config)
+def WatchConfigFiles(hearts_by_config, config_files, load_config):
+  """Reloads configs when their files or programs are modified."""
+  watched = []
+  for config_filename, config in config_files:
+    heart = hearts_by_config.get(id(config))
+    if not heart or not config.get('hot_reload', True):
+      continue
+    heart.LoadProgram()
+    watched.append((config_filename, heart))
+  if watched:
+    poll_seconds = watched[0][1].config.get('reload_poll_seconds', 2)
+    reloading.ConfigWatcher(watched, load_config, poll_seconds).Start()
+
+
+def StartServer(config, hosted_configs=None, config_files=None,
+                load_config=None):
+  """Starts server of the config.
+
+  Args:
+    config: Main config, which is served when page does not specify one.
+    hosted_configs: Further configs served by the same process, by the value
+      of config parameter of the page URL, e.g. /?config=starfleet.
+    config_files: List of (config filename, config) to reload when modified.
+    load_config: Function reading config from its file, for reloading.
+  """
+  simple_server = MakeSimpleLogicLMServer(config, hosted_configs)
+  if config_files and load_config:
+    WatchConfigFiles(simple_server.hearts_by_config, config_files,
+                     load_config)
   port = config.get('port', 1791)
   server_instance = ThreadedTCPServer(('localhost', port), simple_server)
   print('Starting LogicLM server for "%s" intelligence configuration at port %d.' % (
     config['name'], port))
+  for name in sorted(hosted_configs or {}):
+    print('Serving "%s" at http://localhost:%d/?config=%s' % (
+      hosted_configs[name]['name'], port, name))
   try:
     server_instance.serve_forever()
   except KeyboardInterrupt:
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-warming of dashboard charts.
+
+Charts of the dashboard are fully specified requests, so they are run when
+server starts and their responses are kept in memory. They are run again
+periodically and whenever files the program reads are modified. Changes of
+the program itself are handled by reloading the config, which invalidates
+only affected charts.
+"""
+
+import copy
+import os
+import re
+import threading
+import time
+from concurrent import futures
+
+import caching
+
+
+DATA_FILE_PATTERN = re.compile(
+  r'''["']([^"'\n]+\.(?:sqlite|db|duckdb|jsonl?|parquet|csv))["']''')
+
+# Fields of the request that determine its data.
+SEMANTIC_FIELDS = ['measures', 'dimensions', 'filters', 'order', 'limit',
+                   'chartType']
+
+
+def SemanticKey(json_request):
+  """Key of the request, ignoring its title and preview flag.
+
+  Preview is only a faster way to show the same report, so exact report is
+  served to preview requests when it is warm.
+  """
+  semantic_request = {f: json_request.get(f) for f in SEMANTIC_FIELDS}
+  semantic_request['filters'] = sorted(semantic_request['filters'] or [])
+  return caching.RequestKey(semantic_request)
+
+
+def CompileKey(json_request):
+  """Key of the compiled request, from the fields that Olap reads.
+
+  Title, example query and fields added to the request while serving it
+  don't change the compiled report.
+  """
+  compiled_request = {f: json_request.get(f) for f in SEMANTIC_FIELDS}
+  compiled_request['preview'] = bool(json_request.get('preview'))
+  return caching.RequestKey(compiled_request)
+
+
+def DashboardRequests(config):
+  """Requests of the dashboard charts of the config."""
+  dashboard = config.get('dashboard') or {}
+  if not isinstance(dashboard, dict):
+    return []
+  result = []
+  for d in dashboard.get('dashboardCharts', []):
+    for chart in d.get('dashboardChartContents', []):
+      if 'measures' not in chart:
+        continue
+      result.append({f: copy.deepcopy(chart[f])
+                     for f in SEMANTIC_FIELDS + ['title'] if f in chart})
+  return result
+
+
+def DataFiles(config):
+  """Data files the program refers to, which exist."""
+  with open(config['logica_program']) as f:
+    program = f.read()
+  files = DATA_FILE_PATTERN.findall(program)
+  return sorted(set(f for f in files if os.path.exists(f)))
+
+
+def DataVersion(files):
+  version = []
+  for f in files:
+    try:
+      version.append(os.path.getmtime(f))
+    except OSError:
+      version.append(None)
+  return tuple(version)
+
+
+class DashboardWarmer:
+  """Keeps responses to dashboard charts warm.
+
+  Args:
+    heart: LogicLMServerHeart to run the requests with.
+    refresh_seconds: Period of refreshing the responses.
+    max_workers: Number of requests to run concurrently.
+  """
+  def __init__(self, heart, refresh_seconds=600, max_workers=None):
+    self.heart = heart
+    self.refresh_seconds = refresh_seconds
+    self.requests = DashboardRequests(heart.config)
+    self.max_workers = max_workers or min(len(self.requests) or 1,
+                                          os.cpu_count() or 1)
+    self.data_files = DataFiles(heart.config)
+    self.lock = threading.Lock()
+    self.responses = {}
+    self.data_version = None
+    self.rewarm_requested = threading.Event()
+
+  def Warm(self, only_missing=False):
+    """Runs dashboard requests, replacing the kept responses.
+
+    With only_missing set, only requests which responses were invalidated
+    are run.
+    """
+    data_version = DataVersion(self.data_files)
+    with self.lock:
+      requests = [r for r in self.requests
+                  if not (only_missing and SemanticKey(r) in self.responses)]
+    started_at = time.time()
+    def Run(json_request):
+      return self.heart.ExecuteConfig(copy.deepcopy(json_request))
+    with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      responses = list(executor.map(Run, requests))
+    warm = {}
+    for json_request, response in zip(requests, responses):
+      if 'nice_error' in response:
+        self.heart.log.warning('Dashboard chart is not kept warm.', extra={
+          'fields': {'title': json_request.get('title'),
+                     'error': response['nice_error']}})
+        continue
+      warm[SemanticKey(json_request)] = response
+    with self.lock:
+      if only_missing:
+        warm = self.responses | warm
+      self.responses = warm
+      self.data_version = data_version
+    self.heart.log.info('Warmed up %d dashboard charts in %.2f seconds.',
+                        len(requests), time.time() - started_at)
+
+  def Reload(self, config, is_affected):
+    """Takes charts of reloaded config, dropping responses it affects.
+
+    Args:
+      config: Reloaded config.
+      is_affected: Function telling whether a chart request is affected by
+        the changes of the config.
+    """
+    requests = DashboardRequests(config)
+    keys = set(SemanticKey(r) for r in requests)
+    with self.lock:
+      self.requests = requests
+      self.data_files = DataFiles(config)
+      kept = {}
+      for r in requests:
+        key = SemanticKey(r)
+        if key in self.responses and not is_affected(r):
+          kept[key] = self.responses[key]
+      self.responses = kept
+    self.heart.log.info(
+      'Reloaded dashboard keeps %d charts warm, %d are re-run.',
+      len(kept), len(keys) - len(kept))
+    self.rewarm_requested.set()
+
+  def Get(self, json_request):
+    """Returns warm response to the request or None."""
+    with self.lock:
+      response = self.responses.get(SemanticKey(json_request))
+      data_version = self.data_version
+    if response is None or DataVersion(self.data_files) != data_version:
+      return None
+    response = copy.deepcopy(response)
+    response['title'] = json_request.get('title', response.get('title'))
+    return response
+
+  def Start(self, poll_seconds=5):
+    """Warms the charts up and keeps refreshing them in background."""
+    if not self.requests:
+      return
+    def Refresh():
+      last_warm = None
+      while True:
+        try:
+          if (last_warm is None or
+              time.time() - last_warm >= self.refresh_seconds or
+              DataVersion(self.data_files) != self.data_version):
+            last_warm = time.time()
+            self.Warm()
+          elif self.rewarm_requested.is_set():
+            self.rewarm_requested.clear()
+            self.Warm(only_missing=True)
+        except Exception:
+          self.heart.log.exception('Failure of warming dashboard.')
+        self.rewarm_requested.wait(poll_seconds)
+    threading.Thread(target=Refresh, daemon=True).start()
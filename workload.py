@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recording of the workload of the server.
+
+Each request is written as a line of JSON with fields
+  timestamp: Time request arrived, in seconds since epoch.
+  path: Path of the request, e.g. /execute_config.
+  config: Value of config parameter of the request.
+  body: Body of the request.
+  latency_seconds: Time it took to serve the request.
+  response: Translation of the request, for /understand_command only.
+Recorded workload can be replayed by replay.py, and translations can be
+served by ai.RecordedAI instead of the LLM.
+"""
+
+import json
+import threading
+
+
+recorders_lock = threading.Lock()
+recorders = {}
+
+
+class WorkloadRecorder:
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+
+  @classmethod
+  def ForPath(cls, path):
+    """Recorder of the file, shared by all configs recording to it."""
+    with recorders_lock:
+      if path not in recorders:
+        recorders[path] = cls(path)
+      return recorders[path]
+
+  def Record(self, timestamp, path, config, body, latency_seconds,
+             response=None):
+    record = {
+      'timestamp': timestamp,
+      'path': path,
+      'config': config,
+      'body': body,
+      'latency_seconds': latency_seconds
+    }
+    if response is not None:
+      record['response'] = response
+    line = json.dumps(record) + '\n'
+    with self.lock:
+      with open(self.path, 'a') as f:
+        f.write(line)
+
+
+def ReadWorkload(path):
+  with open(path) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+
+def RecordedTranslations(path):
+  """Translations of the recorded natural language requests."""
+  translations = {}
+  for record in ReadWorkload(path):
+    if record['path'] == '/understand_command' and 'response' in record:
+      translations[record['body']] = record['response']
+  return translations